@@ -0,0 +1,223 @@
+""" Benchmarks for cross-validation and the selectors on synthetic data, at increasing row, feature and fold counts.
+Uses a cheap deterministic numpy model, so it runs offline on CPU. Records wall time, peak traced memory and number
+of eval calls per case to a JSON file, and flags regressions against a stored baseline:
+
+    python benchmarks/run_benchmarks.py --save-baseline                 # store benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml_tools.datasets import generate_synthetic_data  # noqa: E402
+from ml_tools.eval import cv_time_series, get_mae_from_cv_time_series  # noqa: E402
+from ml_tools.feature_selector import FeatureSelector  # noqa: E402
+from ml_tools.train_start_selector import TrainStartSelector  # noqa: E402
+from ml_tools.tuner import Tuner  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STEP_DAYS = 10
+EVAL_CALLS = [0]
+
+
+class RidgeModel:
+
+    """ Deterministic ridge regression in numpy, cheap stand-in for a real model """
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.coef = None
+
+    def fit(self, X, y):
+        X = np.column_stack([np.asarray(X, dtype=np.float64), np.ones(len(X))])
+        gram = X.T @ X + self.alpha * np.eye(X.shape[1])
+        self.coef = np.linalg.solve(gram, X.T @ np.asarray(y, dtype=np.float64))
+        return self
+
+    def predict(self, X):
+        return np.column_stack([np.asarray(X, dtype=np.float64), np.ones(len(X))]) @ self.coef
+
+
+def counted_mae(
+        df,
+        model_ref,
+        feature_list: list = None,
+        cv_start: datetime.date = datetime.date(2021, 6, 10),
+        label: str = 'label',
+        hypers: dict = {},
+        step_days: int = STEP_DAYS,
+):
+    EVAL_CALLS[0] += 1
+    return get_mae_from_cv_time_series(
+        df=df,
+        model_ref=model_ref,
+        feature_list=feature_list,
+        cv_start=cv_start,
+        label=label,
+        hypers=hypers,
+        step_days=step_days,
+    )
+
+
+def make_dataset(n_rows: int, n_features: int, n_folds: int, seed: int = 0):
+    start = datetime.datetime(2019, 8, 1)
+    stop = start + datetime.timedelta(hours=n_rows - 1)
+    df = generate_synthetic_data(
+        hour_offset=True,
+        weekday_offset=True,
+        yearly_offset=True,
+        start=str(start),
+        stop=str(stop),
+        seed=seed,
+        noise_scale=5,
+    )
+
+    # A few informative calendar features, padded with noise features
+    rng = np.random.default_rng(seed)
+    calendar = {'hour': df.index.hour, 'dow': df.index.weekday, 'doy': df.index.dayofyear}
+    for name in list(calendar)[:n_features]:
+        df[name] = calendar[name]
+    for i in range(n_features - len(calendar)):
+        df[f'noise_{i}'] = rng.normal(size=len(df))
+
+    cv_start = stop.date() - datetime.timedelta(days=n_folds * STEP_DAYS)
+    return df, cv_start
+
+
+def get_cases(quick: bool = False) -> list:
+    row_counts = [5_000, 20_000] if quick else [10_000, 50_000, 200_000]
+    feature_counts = [4] if quick else [4, 16]
+    fold_counts = [5] if quick else [5, 20]
+
+    cases = []
+    for n_rows in row_counts:
+        for n_features in feature_counts:
+            for n_folds in fold_counts:
+                size = f"rows={n_rows},features={n_features},folds={n_folds}"
+                cases.append((f"cv_time_series[{size}]", bench_cv_time_series, (n_rows, n_features, n_folds)))
+
+    # Selectors run many evals, so benchmark them at the smallest scale of each dimension
+    size_args = (row_counts[0], feature_counts[-1], fold_counts[0])
+    size = "rows={},features={},folds={}".format(*size_args)
+    cases.append((f"FeatureSelector.run[{size}]", bench_feature_selector, size_args))
+    cases.append((f"TrainStartSelector.run[{size}]", bench_train_start_selector, size_args))
+    cases.append((f"Tuner.run[{size}]", bench_tuner, size_args))
+    return cases
+
+
+def bench_cv_time_series(df, cv_start):
+    EVAL_CALLS[0] += 1
+    cv_time_series(df, RidgeModel, [i for i in df.columns if i != 'label'], cv_start=cv_start, step_days=STEP_DAYS)
+
+
+def bench_feature_selector(df, cv_start):
+    FeatureSelector(verbosity=0, remind_sorting=False).run(
+        eval_func=counted_mae,
+        df=df,
+        model_ref=RidgeModel,
+        cv_start=cv_start,
+        feature_list=[i for i in df.columns if i != 'label'],
+    )
+
+
+def bench_train_start_selector(df, cv_start):
+    TrainStartSelector(eval_window_rows=len(df[cv_start:]), min_train_rows=24 * 7, n_trials=10).run(
+        eval_func=counted_mae,
+        df=df,
+        model_ref=RidgeModel,
+        cv_start=cv_start,
+        feature_list=[i for i in df.columns if i != 'label'],
+    )
+
+
+def bench_tuner(df, cv_start):
+    Tuner(lazy_optuna_space=[('alpha', 'trial.suggest_float', 0.01, 10)], n_trials=10, verbosity=0).run(
+        eval_func=counted_mae,
+        df=df,
+        model_ref=RidgeModel,
+        cv_start=cv_start,
+        feature_list=[i for i in df.columns if i != 'label'],
+    )
+
+
+def measure(bench_func, df, cv_start, trace_memory: bool = True) -> dict:
+    EVAL_CALLS[0] = 0
+    start = time.perf_counter()
+    bench_func(df, cv_start)
+    result = {'wall_time': time.perf_counter() - start, 'eval_calls': EVAL_CALLS[0]}
+
+    # Separate run for memory, since tracing slows down allocations and would skew wall time
+    if trace_memory:
+        tracemalloc.start()
+        bench_func(df, cv_start)
+        result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    return result
+
+
+def run_benchmarks(quick: bool = False, trace_memory: bool = True, verbosity: int = 1) -> dict:
+    results = {}
+    for name, bench_func, (n_rows, n_features, n_folds) in get_cases(quick):
+        df, cv_start = make_dataset(n_rows, n_features, n_folds)
+        results[name] = measure(bench_func, df, cv_start, trace_memory)
+        if verbosity >= 1:
+            print(f"{name}: {results[name]}")
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+
+    """ Cases where wall time or peak memory grew more than tolerance (relative), or more eval calls were made """
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ['wall_time', 'peak_memory_mb']:
+            if metric in result and metric in baseline[name]:
+                if result[metric] > baseline[name][metric] * (1 + tolerance):
+                    regressions.append(f"{name}: {metric} {result[metric]:.3f} vs baseline "
+                                       f"{baseline[name][metric]:.3f}")
+        if result['eval_calls'] > baseline[name]['eval_calls']:
+            regressions.append(f"{name}: eval_calls {result['eval_calls']} vs baseline "
+                               f"{baseline[name]['eval_calls']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_output.json', help='Where to write results')
+    parser.add_argument('--baseline', default=None, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Also write results to {DEFAULT_BASELINE}')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before flagging')
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes, for a fast smoke run')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced memory run')
+    args = parser.parse_args()
+
+    results = run_benchmarks(quick=args.quick, trace_memory=not args.no_memory)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import pickle
+import shutil
+
+from ml_tools.eval_cache import EvalCache, fingerprint, get_inputs_fingerprint
+
+# Selector attributes that don't change the search result, or are set by the checkpoint itself
+RUNTIME_ATTRIBUTES = ('verbosity', 'cache', 'callbacks', 'executor', 'n_jobs', 'n_workers', 'storage',
+                      'study_name', 'inputs_fingerprint', 'remind_sorting')
+
+
+class PipelineCheckpoint:
+
+    """ Stage level checkpoint of a ModelAssumptionSelector run in a local directory. Completed stages are saved
+    with their search result and the kwargs they lead to (train start, feature_list, hypers), so a rerun with the
+    same inputs (eval_func, kwargs incl. data and selector settings) resumes at the first unfinished stage.
+    Progress within a stage is kept by giving selectors that don't have their own an Optuna study in the
+    directory (Tuner, TrainStartSelector) and an on-disk EvalCache (all selectors), so finished trials and
+    evaluations are not repeated either. Inputs that don't match the checkpoint reset the directory. """
+
+    def __init__(self, checkpoint_dir: str, verbosity: int = 1):
+        self.checkpoint_dir = checkpoint_dir
+        self.verbosity = verbosity
+        self.fingerprint = None
+        self.stages = []
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.checkpoint_dir, 'checkpoint.pkl')
+
+    def load(self, eval_func, kwargs: dict, selectors: tuple) -> list:
+
+        """ Returns completed stages that are valid for these inputs """
+
+        self.fingerprint = get_inputs_fingerprint(eval_func, kwargs, get_selector_settings(selectors))
+        self.stages = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                checkpoint = pickle.load(f)
+            if checkpoint['fingerprint'] == self.fingerprint:
+                self.stages = checkpoint['stages']
+            else:
+                if self.verbosity >= 1:
+                    print(f"Checkpoint in {self.checkpoint_dir} is for other inputs, starting over")
+                self.reset()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        return self.stages
+
+    def prepare_selector(self, stage_index: int, selector) -> dict:
+
+        """ Points storage and cache of selector into the directory, returns the original attributes to restore
+        after the stage, so the selector can be reused with another checkpoint_dir """
+
+        stage = selector.__class__.__name__
+        original_attributes = {}
+        if hasattr(selector, 'storage') and selector.storage is None:
+            original_attributes['storage'] = selector.storage
+            selector.storage = os.path.join(self.checkpoint_dir, f"stage_{stage_index}_{stage}.db")
+        if hasattr(selector, 'cache') and selector.cache is None:
+            original_attributes['cache'] = selector.cache
+            selector.cache = EvalCache(cache_dir=os.path.join(self.checkpoint_dir, 'eval_cache'))
+        return original_attributes
+
+    def save_stage(self, stage: str, search_result, kwargs: dict):
+        self.stages.append({
+            'stage': stage,
+            'search_result': search_result,
+            'kwargs': {
+                'train_start': kwargs['df'].index[0] if 'df' in kwargs and len(kwargs['df']) else None,
+                'feature_list': kwargs.get('feature_list'),
+                'hypers': kwargs.get('hypers'),
+            },
+        })
+
+        # Write to temporary file first, so a crash while saving doesn't corrupt the checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'fingerprint': self.fingerprint, 'stages': self.stages}, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        # Only remove what the checkpoint itself writes
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(os.path.join(self.checkpoint_dir, 'eval_cache'), ignore_errors=True)
+        for file_name in os.listdir(self.checkpoint_dir):
+            if file_name.startswith('stage_') and file_name.endswith('.db'):
+                os.remove(os.path.join(self.checkpoint_dir, file_name))
+        self.stages = []
+
+
+def get_selector_settings(selectors: tuple) -> list:
+    # Settings that change the search result, per selector
+    return [
+        (selector.__class__.__name__,
+         fingerprint({k: v for k, v in vars(selector).items()
+                      if k not in RUNTIME_ATTRIBUTES and isinstance(v, (int, float, str, bool, list, tuple))}))
+        for selector in selectors
+    ]
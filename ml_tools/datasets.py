@@ -1,16 +1,60 @@
 import numpy as np
 import pandas as pd
 
+# Multiplicative offsets, looked up by index.hour and index.weekday
+HOUR_OFFSETS = np.array([
+    0.2, 0.1, 0.1, 0.05, 0.05, 0.1, 0.5, 0.7, 1.1, 1.2, 1.1, 1,
+    1, 0.9, 1, 1.1, 1.15, 1.1, 1.1, 0.9, 0.85, 0.75, 0.5, 0.3
+])
+WEEKDAY_OFFSETS = np.array([1.2, 1.1, 1.05, 1, 1, 0.90, 0.90])
+
 
 def get_yearly_sin_seasonality(
         df: pd.DataFrame,
         normalize_factor: float = 0.2
 ) -> pd.Series:
-    def get_sin(row):
-        doy = row.name.dayofyear
-        return np.sin(2 * np.pi * doy / 366) * normalize_factor + 1
+    return pd.Series(get_yearly_sin_values(df.index, normalize_factor), index=df.index)
+
 
-    return df.apply(get_sin, axis=1)
+def get_yearly_sin_values(
+        index: pd.DatetimeIndex,
+        normalize_factor: float = 0.2
+) -> np.ndarray:
+    # Lookup array over day of year (1-366), instead of computing sin per row
+    yearly_lookup = np.sin(2 * np.pi * np.arange(367) / 366) * normalize_factor + 1
+    return yearly_lookup[np.asarray(index.dayofyear)]
+
+
+def get_synthetic_label_values(
+        index: pd.DatetimeIndex,
+        position: np.ndarray,  # Row number of each timestamp in the full time range, for the trend
+        n_rows: int,  # Number of timestamps in the full time range
+        hour_offset: bool = False,
+        weekday_offset: bool = False,
+        yearly_offset: bool = False,
+        start_value: float = 100,
+        trend_stop_value: float = 400,
+) -> np.ndarray:
+
+    # Create linear trend, same as np.linspace(start_value, trend_stop_value, n_rows)[position]
+    if trend_stop_value is not None:
+        step = (trend_stop_value - start_value) / max(n_rows - 1, 1)
+        values = position * step + start_value
+    else:
+        values = np.full(len(index), start_value, dtype=np.float64)
+
+    if yearly_offset:
+        values = values * get_yearly_sin_values(index)
+
+    # Offset hour of day
+    if hour_offset:
+        values = values * HOUR_OFFSETS[np.asarray(index.hour)]
+
+    # Offset day of week
+    if weekday_offset:
+        values = values * WEEKDAY_OFFSETS[np.asarray(index.weekday)]
+
+    return values
 
 
 def generate_synthetic_data(
@@ -23,67 +67,198 @@ def generate_synthetic_data(
         start_value: float = 100,
         trend_stop_value: float = 400,
         label: str = 'label',
+        dtype: str = 'float64',  # E.g. 'float32' to halve memory of large datasets
+        seed: int = None,  # Seed for noise and series levels, for reproducible datasets
+        noise_scale: float = 0,  # Std of gaussian noise added to label
+        n_series: int = 1,  # Number of entities, if > 1 output is a long format panel sorted by time
+        entity_col: str = 'series_id',
 ) -> pd.DataFrame:
 
-    # Create placeholder df
-    df = pd.DataFrame(index=[pd.to_datetime(start), pd.to_datetime(stop)])
-    df = df.asfreq(freq)
+    """ Synthetic time series with linear trend and optional yearly, weekday and hour seasonality. Computed with
+    lookup arrays over the index, so also large hourly datasets are generated quickly. With n_series > 1 every
+    timestamp is repeated once per entity (entity_col), where each entity has its own level. """
 
-    # Create linear trend
-    if trend_stop_value is not None:
-        df[label] = np.linspace(start_value, trend_stop_value, len(df))
-    else:
-        df[label] = start_value
+    chunks = iter_synthetic_data_chunks(
+        chunk_rows=None,
+        hour_offset=hour_offset,
+        weekday_offset=weekday_offset,
+        yearly_offset=yearly_offset,
+        freq=freq,
+        start=start,
+        stop=stop,
+        start_value=start_value,
+        trend_stop_value=trend_stop_value,
+        label=label,
+        dtype=dtype,
+        seed=seed,
+        noise_scale=noise_scale,
+        n_series=n_series,
+        entity_col=entity_col,
+    )
 
-    if yearly_offset:
-        df[label] *= get_yearly_sin_seasonality(df)
+    return next(chunks)
+
+
+def iter_synthetic_data_chunks(
+        chunk_rows: int = 1_000_000,  # Timestamps per chunk (times n_series rows), None for one chunk
+        hour_offset: bool = False,
+        weekday_offset: bool = False,
+        yearly_offset: bool = False,
+        freq: str = 'h',
+        start: str = '2019-08-01 00:00',
+        stop: str = '2022-01-07 23:00',
+        start_value: float = 100,
+        trend_stop_value: float = 400,
+        label: str = 'label',
+        dtype: str = 'float64',
+        seed: int = None,
+        noise_scale: float = 0,
+        n_series: int = 1,
+        entity_col: str = 'series_id',
+):
+
+    """ Same data as generate_synthetic_data, but yielded as consecutive chunks of the time range, so datasets
+    larger than memory can be streamed (see write_synthetic_parquet and write_synthetic_memmap). The trend is
+    computed from each row's position in the full range, so chunks line up exactly. """
 
-    # Offset hour of day
     if hour_offset:
         assert freq == 'h'
-        hour_offset_dict = {
-            0: 0.2,
-            1: 0.1,
-            2: 0.1,
-            3: 0.05,
-            4: 0.05,
-            5: 0.1,
-            6: 0.5,
-            7: 0.7,
-            8: 1.1,
-            9: 1.2,
-            10: 1.1,
-            11: 1,
-            12: 1,
-            13: 0.9,
-            14: 1,
-            15: 1.1,
-            16: 1.15,
-            17: 1.1,
-            18: 1.1,
-            19: 0.9,
-            20: 0.85,
-            21: 0.75,
-            22: 0.5,
-            23: 0.3
-        }
-        for hour in hour_offset_dict.keys():
-            df.loc[df.index.hour == hour, label] = (
-                    df.loc[df.index.hour == hour, label] * hour_offset_dict[hour])
+    assert n_series >= 1
 
-    # Offset day of week
-    if weekday_offset:
-        weekday_offset_dict = {
-            0: 1.2,
-            1: 1.1,
-            2: 1.05,
-            3: 1,
-            4: 1,
-            5: 0.90,
-            6: 0.90
-        }
-        for weekday in weekday_offset_dict.keys():
-            df.loc[df.index.weekday == weekday, label] = (
-                    df.loc[df.index.weekday == weekday, label] * weekday_offset_dict[weekday])
-
-    return df
+    n_timestamps = get_synthetic_n_timestamps(freq=freq, start=start, stop=stop)
+    chunk_rows = max(n_timestamps, 1) if chunk_rows is None else chunk_rows
+    assert chunk_rows >= 1
+
+    rng = np.random.default_rng(seed)
+    levels = rng.uniform(0.5, 1.5, size=n_series) if n_series > 1 else None
+
+    for chunk_start in range(0, max(n_timestamps, 1), chunk_rows):
+        chunk_stop = min(chunk_start + chunk_rows, n_timestamps)
+        index = get_synthetic_index(freq=freq, start=start, stop=stop, position_start=chunk_start,
+                                    periods=chunk_stop - chunk_start)
+        values = get_synthetic_label_values(
+            index=index,
+            position=np.arange(chunk_start, chunk_stop),
+            n_rows=n_timestamps,
+            hour_offset=hour_offset,
+            weekday_offset=weekday_offset,
+            yearly_offset=yearly_offset,
+            start_value=start_value,
+            trend_stop_value=trend_stop_value,
+        )
+
+        if levels is None:
+            df = pd.DataFrame({label: values}, index=index)
+        else:
+            # Time major order, so the index stays sorted for cross-validation
+            df = pd.DataFrame(
+                {
+                    entity_col: np.tile(np.arange(n_series), len(index)),
+                    label: np.outer(values, levels).ravel(),
+                },
+                index=index.repeat(n_series),
+            )
+
+        if noise_scale:
+            df[label] += rng.normal(scale=noise_scale, size=len(df))
+        df[label] = df[label].astype(dtype)
+
+        yield df
+
+
+def get_synthetic_n_timestamps(
+        freq: str = 'h',
+        start: str = '2019-08-01 00:00',
+        stop: str = '2022-01-07 23:00',
+) -> int:
+    offset = pd.tseries.frequencies.to_offset(freq)
+    start, stop = pd.to_datetime(start), pd.to_datetime(stop)
+    if isinstance(offset, pd.tseries.offsets.Tick):
+        # Fixed frequency, count without materializing the index
+        return max((stop - start) // pd.Timedelta(offset) + 1, 0)
+    return len(pd.date_range(start=start, end=stop, freq=freq))
+
+
+def get_synthetic_index(
+        freq: str,
+        start: str,
+        stop: str,
+        position_start: int,
+        periods: int,
+) -> pd.DatetimeIndex:
+    offset = pd.tseries.frequencies.to_offset(freq)
+    start = pd.to_datetime(start)
+    if isinstance(offset, pd.tseries.offsets.Tick):
+        return pd.date_range(start=start + pd.Timedelta(offset) * position_start, periods=periods, freq=freq)
+    # Calendar frequencies (e.g. month starts) are short anyway, slice the full index
+    return pd.date_range(start=start, end=pd.to_datetime(stop), freq=freq)[position_start:position_start + periods]
+
+
+def write_synthetic_parquet(
+        path: str,
+        chunk_rows: int = 1_000_000,
+        **kwargs,  # Arguments to iter_synthetic_data_chunks
+) -> int:
+
+    """ Streams synthetic data to a Parquet file with one row group per chunk, returns number of rows written.
+    Requires pyarrow. """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('write_synthetic_parquet requires pyarrow, install with: pip install pyarrow') from e
+
+    n_rows = 0
+    writer = None
+    try:
+        for df in iter_synthetic_data_chunks(chunk_rows=chunk_rows, **kwargs):
+            if writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=True)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=True)
+            writer.write_table(table, row_group_size=len(df))
+            n_rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+
+def write_synthetic_memmap(
+        path: str,
+        chunk_rows: int = 1_000_000,
+        **kwargs,  # Arguments to iter_synthetic_data_chunks
+) -> np.memmap:
+
+    """ Streams synthetic data to a NumPy memmap with a structured dtype: timestamp (int64 ns since epoch),
+    entity_col if n_series > 1, and label. Returns the memmap opened read-only. """
+
+    freq = kwargs.get('freq', 'h')
+    start = kwargs.get('start', '2019-08-01 00:00')
+    stop = kwargs.get('stop', '2022-01-07 23:00')
+    label = kwargs.get('label', 'label')
+    entity_col = kwargs.get('entity_col', 'series_id')
+    n_series = kwargs.get('n_series', 1)
+
+    fields = [('timestamp', 'i8')]
+    if n_series > 1:
+        fields.append((entity_col, 'i4'))
+    fields.append((label, kwargs.get('dtype', 'float64')))
+    n_rows = get_synthetic_n_timestamps(freq=freq, start=start, stop=stop) * n_series
+
+    memmap = np.memmap(path, dtype=np.dtype(fields), mode='w+', shape=(n_rows,))
+    row = 0
+    for df in iter_synthetic_data_chunks(chunk_rows=chunk_rows, **kwargs):
+        chunk = memmap[row:row + len(df)]
+        chunk['timestamp'] = df.index.asi8
+        if n_series > 1:
+            chunk[entity_col] = df[entity_col].to_numpy()
+        chunk[label] = df[label].to_numpy()
+        row += len(df)
+    memmap.flush()
+    del memmap
+
+    return np.memmap(path, dtype=np.dtype(fields), mode='r', shape=(n_rows,))
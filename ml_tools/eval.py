@@ -1,5 +1,211 @@
+import numpy as np
 import pandas as pd
 import datetime
+import inspect
+import os
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Union
+from ml_tools.instrumentation import emit
+
+
+class FoldPlan:
+
+    """ Fold boundaries for expanding window cross-validation, computed once with a binary search on the sorted
+    index. Fold i trains on rows [0, train_ends[i]), i.e. up to and including the split date (at midnight), and
+    predicts rows [train_ends[i], test_ends[i]). Rows after that are predicted by later folds, which have seen
+    more data. Can be passed as fold_plan to cv_time_series / get_mae_from_cv_time_series (also via the kwargs
+    of the selectors) to share between calls on the same df. """
+
+    def __init__(
+            self,
+            index: pd.DatetimeIndex,
+            cv_start: datetime.date = datetime.date(2021, 6, 10),
+            step_days: int = 10,
+    ):
+        assert index.is_monotonic_increasing, 'Index must be sorted so older data appears on top'
+        self.cv_start = cv_start
+        self.step_days = step_days
+        self.index = index  # Reference, pandas indexes are immutable
+        self.n_rows = len(index)
+        self.index_range = (index[0], index[-1]) if len(index) else None
+
+        splits = []
+        split = cv_start
+        while len(index) and split < index[-1].date():
+            splits.append(split)
+            split += datetime.timedelta(days=step_days)
+        self.splits = splits
+
+        split_index = pd.DatetimeIndex(splits)
+        if index.tz is not None:
+            split_index = split_index.tz_localize(index.tz)
+        train_ends = np.asarray(index.searchsorted(split_index, side='right'), dtype=np.int64)
+        test_ends = np.append(train_ends[1:], self.n_rows).astype(np.int64)
+
+        # Skip folds without rows to train on or predict (e.g. gaps in data longer than step_days)
+        keep = (train_ends > 0) & (test_ends > train_ends)
+        self.train_ends = train_ends[keep]
+        self.test_ends = test_ends[keep]
+
+    def __len__(self):
+        return len(self.train_ends)
+
+    def __repr__(self):
+        return (f"FoldPlan(cv_start={self.cv_start!r}, step_days={self.step_days}, n_rows={self.n_rows}, "
+                f"index_range={self.index_range!r}, n_folds={len(self)})")
+
+    def folds(self) -> list:
+        return list(zip(self.train_ends.tolist(), self.test_ends.tolist()))
+
+    def matches(self, index: pd.DatetimeIndex, cv_start: datetime.date, step_days: int) -> bool:
+        # Full index, as another frame of the same length and endpoints can have other fold boundaries
+        return (
+            self.cv_start == cv_start
+            and self.step_days == step_days
+            and self.n_rows == len(index)
+            and (index is self.index or self.index.equals(index))
+        )
+
+
+class FeatureMatrix:
+
+    """ Feature columns of a df held once as one contiguous column-major (Fortran order) numpy block, optionally
+    as float32 to halve memory. Feature subsets are then gathered by column position, which for a column-major
+    block is one contiguous copy per column (and a view when the columns are adjacent), instead of building a new
+    DataFrame per candidate, and folds are row ranges (views) of that. Can be passed as feature_matrix to
+    cv_time_series / get_mae_from_cv_time_series (also via the kwargs of the selectors) for any contiguous row
+    slice of the df it was built from, e.g. the train starts of TrainStartSelector, if its index is unique (for a
+    panel, features are then taken from df). Like EvalCache, it assumes the data is not changed in place after
+    building it. """
+
+    def __init__(
+            self,
+            df: pd.DataFrame,
+            columns: list = None,  # Columns to hold, defaults to all columns of df
+            dtype=None,  # Optional dtype of block, e.g. np.float32
+    ):
+        self.columns = list(columns) if columns is not None else list(df.columns)
+        self.column_positions = {column: position for position, column in enumerate(self.columns)}
+        self.index = df.index
+        self.values = np.asfortranarray(df[self.columns].to_numpy(dtype=dtype))
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __repr__(self):
+        # Deterministic, so the dtype (which can change scores) is part of EvalCache keys
+        index_range = (self.index[0], self.index[-1]) if len(self.index) else None
+        return (f"FeatureMatrix(shape={self.values.shape}, dtype={self.dtype}, columns={self.columns!r}, "
+                f"index_range={index_range!r})")
+
+    def row_offset(self, df: pd.DataFrame):
+        # Position of df's first row in the block if df is a contiguous row slice of the source, else None. Rows
+        # can't be told apart by timestamp in an index with duplicates (e.g. a panel), so those are never matched.
+        if len(df) == 0 or len(df) > len(self.index) or not self.index.is_unique:
+            return None
+        offset = int(self.index.searchsorted(df.index[0], side='left'))
+        if offset + len(df) > len(self.index) or not self.index[offset:offset + len(df)].equals(df.index):
+            return None
+        return offset
+
+    def get_features(self, feature_list: list, start: int = 0, stop: int = None) -> np.ndarray:
+        positions = [self.column_positions[feature] for feature in feature_list]
+        rows = self.values[start:stop]
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            return rows[:, positions[0]:positions[0] + len(positions)]
+        return rows.take(positions, axis=1)
+
+    def covers(self, feature_list: list) -> bool:
+        return len(feature_list) > 0 and all(feature in self.column_positions for feature in feature_list)
+
+
+class CVResult:
+
+    """ Compact result of cv_time_series: the prediction buffer, labels and fold boundaries as numpy arrays (sharing
+    memory with df where possible), so metrics are computed directly on the buffers without copying df. Rows
+    before the first fold are NaN in predictions and fold -1 in fold_ids. Materialize with to_frame if needed. """
+
+    def __init__(
+            self,
+            index: pd.Index,
+            labels: np.ndarray,
+            predictions: np.ndarray,
+            folds: list,  # (train_end, test_end) per fold, fold i predicts rows [train_end, test_end)
+            label: str = 'label',
+            pred: str = 'cv_pred',
+    ):
+        self.index = index
+        self.labels = labels
+        self.predictions = predictions
+        self.folds = folds
+        self.label = label
+        self.pred = pred
+
+    def __len__(self):
+        return len(self.predictions)
+
+    @property
+    def fold_ids(self) -> np.ndarray:
+        fold_ids = np.full(len(self.predictions), -1, dtype=np.int32)
+        for fold, (train_end, test_end) in enumerate(self.folds):
+            fold_ids[train_end:test_end] = fold
+        return fold_ids
+
+    def get_errors(self) -> np.ndarray:
+        # Labels minus predictions, for predicted rows with a label only
+        errors = self.labels - self.predictions
+        return errors[~np.isnan(errors)]
+
+    def mae(self) -> float:
+        return float(np.mean(np.abs(self.get_errors())))
+
+    def rmse(self) -> float:
+        return float(np.sqrt(np.mean(np.square(self.get_errors()))))
+
+    def mape(self) -> float:
+        # Rows with zero label are left out, their percentage error is undefined
+        errors = self.labels - self.predictions
+        valid = ~np.isnan(errors) & (self.labels != 0)
+        return float(np.mean(np.abs(errors[valid] / self.labels[valid])))
+
+    def pinball(self, quantile: float = 0.5) -> float:
+        errors = self.get_errors()
+        return float(np.mean(np.maximum(quantile * errors, (quantile - 1) * errors)))
+
+    def fold_metrics(self, quantile: float = 0.5) -> pd.DataFrame:
+
+        """ MAE, RMSE, MAPE and pinball loss per fold, with number of rows predicted """
+
+        rows = []
+        for fold, (train_end, test_end) in enumerate(self.folds):
+            fold_result = CVResult(self.index[train_end:test_end], self.labels[train_end:test_end],
+                                   self.predictions[train_end:test_end], [(0, test_end - train_end)])
+            rows.append({
+                'fold': fold,
+                'train_rows': train_end,
+                'test_rows': test_end - train_end,
+                'mae': fold_result.mae(),
+                'rmse': fold_result.rmse(),
+                'mape': fold_result.mape(),
+                'pinball': fold_result.pinball(quantile),
+            })
+        return pd.DataFrame(rows).set_index('fold')
+
+    def to_frame(self, df: pd.DataFrame = None) -> pd.DataFrame:
+
+        """ Copy of df with the pred column added if df is given, else label, pred and fold per row """
+
+        if df is not None:
+            df = df.copy()
+            df[self.pred] = self.predictions
+            return df
+        return pd.DataFrame({self.label: self.labels, self.pred: self.predictions, 'fold': self.fold_ids},
+                            index=self.index)
 
 
 def cv_time_series(
@@ -10,31 +216,253 @@ def cv_time_series(
         hypers: dict = {},
         pred: str = 'cv_pred',
         cv_start: datetime.date = datetime.date(2021, 6, 10),
-        step_days=10
-) -> pd.DataFrame:
+        step_days=10,
+        fold_plan: FoldPlan = None,
+        n_jobs: int = 1,
+        parallel_backend: str = 'thread',
+        incremental: bool = False,
+        callbacks: list = None,
+        trial=None,
+        feature_matrix: FeatureMatrix = None,
+        dataset_cache=None,
+        as_frame: bool = True,
+        entity_col: str = None,
+        model_per_entity: bool = False,
+        fold_store=None,
+) -> Union[pd.DataFrame, CVResult]:
+
+    """ Expanding Window Cross-validation for time series. Fold boundaries come from fold_plan (rebuilt if it
+    does not match df), features and label are sliced positionally from arrays, so the model is fitted on
+    numpy arrays rather than DataFrames.
+    With n_jobs != 1 (-1 for all cores) every fold gets a fresh model_ref(**hypers) and folds are fitted
+    concurrently in a thread or process pool (parallel_backend), with at most n_jobs folds submitted at a time.
+    Predictions are merged in fold order, so for deterministic models the result is the same as the sequential
+    run with threads, and the same up to floating point rounding with processes (which get a pickled copy of the
+    fold's rows, so linear algebra can round differently). Threads suit estimators that release the GIL (e.g.
+    LightGBM, then consider limiting its own n_jobs in hypers), processes need a picklable model_ref.
+    With incremental=True one model is trained across folds, where each fold after the first only feeds the rows
+    appended since the previous fold: with partial_fit for estimators that have it, or by continuing boosting
+    from the previous booster for LightGBM (init_model, each fold adds n_estimators trees). Fold cost then
+    scales with step_days rather than with all history, at some cost of accuracy since old rows are not revisited
+    (usually acceptable for ranking candidates in the selectors, check against full refit before relying on the
+    absolute score). Estimators that can't continue training fall back to full refit every fold.
+    Optional callbacks (see ml_tools.instrumentation) get a fold event with fit and predict time per fold.
+    With an optuna trial, the running MAE over all rows predicted so far is reported after every fold, and
+    optuna.TrialPruned is raised as soon as the trial's pruner says so (see Tuner).
+    With a feature_matrix built from df, or from a df that df is a contiguous row slice of, features are gathered
+    from it instead of from df, so repeated calls with different feature_list don't copy the data via pandas.
+    With a dataset_cache (see ml_tools.lgbm_backend.LGBMDatasetCache), LightGBM models train on binned datasets
+    constructed once per fold instead of re-binning the features in every call.
+    Returns a copy of df with the pred column added, or with as_frame=False a CVResult (predictions and metrics
+    as arrays, without copying df).
+    For panels of many series in long format (one row per entity and timestamp, sorted by time, entity in
+    entity_col), folds are assigned by timestamp across all entities, since the fold boundaries are binary
+    searched on the (duplicate) timestamps. By default one global model is trained per fold on all entities
+    (entity_col can also be in feature_list, if numeric). With model_per_entity=True every entity gets its own
+    model per fold instead, with the entities of a fold fitted concurrently when n_jobs != 1.
+    With a fold_store (see ml_tools.fold_store.FoldStore), predictions of folds whose rows didn't change since an
+    earlier call are reused, so a rerun after appending data only fits the new folds. """
+
+    if feature_list is None:
+        feature_list = [i for i in df.columns if i not in [label, entity_col]]
+
+    if fold_plan is None or not fold_plan.matches(df.index, cv_start, step_days):
+        fold_plan = FoldPlan(df.index, cv_start=cv_start, step_days=step_days)
+
+    labels = df[label].to_numpy()
+    folds = fold_plan.folds()
+    running_error = {'sum': 0.0, 'count': 0}
+
+    cached_predictions = None
+    if dataset_cache is not None and n_jobs == 1 and not incremental and not model_per_entity:
+        # None for models, hypers or data the cache can't evaluate, which then take the generic path below
+        cached_predictions = dataset_cache.predict_folds(
+            df, model_ref, feature_list, label, hypers, fold_plan, callbacks, trial)
+
+    if cached_predictions is not None:
+        predictions = cached_predictions
+    elif model_per_entity:
+        assert entity_col is not None, 'model_per_entity needs entity_col'
+        assert not incremental, 'Incremental training is not supported per entity'
+        predictions = predict_per_entity(df[entity_col], model_ref, hypers, get_feature_array(
+            df, feature_list, feature_matrix), labels, folds, n_jobs, parallel_backend, callbacks, trial)
+    elif fold_store is not None and n_jobs == 1 and not incremental:
+        predictions = fold_store.predict_folds(df, model_ref, feature_list, label, hypers, get_feature_array(
+            df, feature_list, feature_matrix), labels, folds, callbacks, trial)
+    elif n_jobs == 1:
+        features = get_feature_array(df, feature_list, feature_matrix)
+        predictions = np.full(len(df), np.nan)
+        model = model_ref(**hypers)
+        continue_training = get_continue_training(model) if incremental else None
+        previous_train_end = 0
+        for fold, (train_end, test_end) in enumerate(folds):
+            start = time.perf_counter()
+            if continue_training is None or previous_train_end == 0:
+                fit_start = 0
+                model.fit(
+                    features[:train_end],
+                    labels[:train_end],
+                )
+            else:
+                fit_start = previous_train_end
+                continue_training(
+                    features[previous_train_end:train_end],
+                    labels[previous_train_end:train_end],
+                )
+            previous_train_end = train_end
+            fit_end = time.perf_counter()
+            predictions[train_end:test_end] = (
+                model.predict(features[train_end:test_end])
+            )
+            emit_fold(callbacks, fold, train_end - fit_start, test_end - train_end, start, fit_end,
+                      time.perf_counter())
+            report_fold(trial, fold, labels[train_end:test_end], predictions[train_end:test_end], running_error)
+    else:
+        assert not incremental, 'Incremental training continues one model across folds, use n_jobs=1'
+        assert parallel_backend in ['thread', 'process']
+        executor_class = ThreadPoolExecutor if parallel_backend == 'thread' else ProcessPoolExecutor
+        features = get_feature_array(df, feature_list, feature_matrix)
+        predictions = np.full(len(df), np.nan)
+        max_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+        # Process workers get a pickled copy of the rows, restored to the column-major layout of the sequential path
+        fortran = parallel_backend == 'process' and features.flags.f_contiguous
+        executor = executor_class(max_workers=max_workers)
+        in_flight = deque()
+
+        def merge_oldest_fold():
+            # Merged in fold order, so the result doesn't depend on which worker finishes first
+            fold, train_end, test_end, future = in_flight.popleft()
+            fold_prediction, start, fit_end, end = future.result()
+            predictions[train_end:test_end] = fold_prediction
+            emit_fold(callbacks, fold, train_end, test_end - train_end, start, fit_end, end)
+            report_fold(trial, fold, labels[train_end:test_end], fold_prediction, running_error)
+
+        try:
+            for fold, (train_end, test_end) in enumerate(folds):
+                # At most max_workers folds submitted at a time, so processes don't hold a copy of every fold
+                if len(in_flight) >= max_workers:
+                    merge_oldest_fold()
+                in_flight.append((fold, train_end, test_end, executor.submit(
+                    fit_predict_fold, model_ref, hypers, features[:test_end], labels[:train_end], fortran)))
+            while in_flight:
+                merge_oldest_fold()
+        except BaseException:
+            # E.g. pruned, don't wait for remaining folds
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    result = CVResult(df.index, labels, predictions, folds, label=label, pred=pred)
+
+    return result.to_frame(df) if as_frame else result
+
+
+def get_feature_array(df, feature_list, feature_matrix=None) -> np.ndarray:
+    row_offset = None
+    if feature_matrix is not None and feature_matrix.covers(feature_list):
+        row_offset = feature_matrix.row_offset(df)
+    if row_offset is not None:
+        return feature_matrix.get_features(feature_list, row_offset, row_offset + len(df))
+    return df[feature_list].to_numpy()
 
-    """ Expanding Window Cross-validation for time series """
 
-    df = df.copy()
-    split = cv_start
+def get_continue_training(model):
+
+    """ Function that continues training model on new rows only, or None if the estimator can't """
+
+    if hasattr(model, 'partial_fit'):
+        return model.partial_fit
+    if 'init_model' in inspect.signature(model.fit).parameters:
+        # LightGBM sklearn API: continue boosting from the booster of the previous fold
+        return lambda features, labels: model.fit(features, labels, init_model=model.booster_)
+    warnings.warn(f"{model.__class__.__name__} can't continue training, falling back to full refit per fold")
+    return None
+
+
+def fit_predict_fold(model_ref, hypers, features, labels, fortran=False):
+    # Fit fresh model on first len(labels) rows and predict the rest, module level to be picklable
+    start = time.perf_counter()
+    if fortran:
+        features = np.asfortranarray(features)
     model = model_ref(**hypers)
+    model.fit(features[:len(labels)], labels)
+    fit_end = time.perf_counter()
+    fold_prediction = model.predict(features[len(labels):])
+    return fold_prediction, start, fit_end, time.perf_counter()
+
+
+def predict_per_entity(entities, model_ref, hypers, features, labels, folds, n_jobs=1, parallel_backend='thread',
+                       callbacks=None, trial=None):
+
+    """ Cross-validation predictions with a model per entity and fold, for the global fold boundaries. Folds run
+    in order with the entities of a fold fitted concurrently when n_jobs != 1, so fold events and pruning work
+    as for one global model. """
+
+    # Rows of each entity together, still in time order, without a Python loop over rows
+    codes = pd.factorize(entities)[0]
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(codes.max() + 2))
+    entity_rows = [order[bounds[code]:bounds[code + 1]] for code in range(len(bounds) - 1)]
+    entity_features = [features[rows] for rows in entity_rows]
+    entity_labels = [labels[rows] for rows in entity_rows]
+
+    executor = None
+    if n_jobs != 1:
+        assert parallel_backend in ['thread', 'process']
+        executor_class = ThreadPoolExecutor if parallel_backend == 'thread' else ProcessPoolExecutor
+        executor = executor_class(max_workers=None if n_jobs == -1 else n_jobs)
+
+    predictions = np.full(len(labels), np.nan)
+    running_error = {'sum': 0.0, 'count': 0}
+    try:
+        for fold, (train_end, test_end) in enumerate(folds):
+            start = time.perf_counter()
+            # Fold boundaries within each entity: its number of rows before the global boundary, entities without
+            # rows to train on or predict in this fold are skipped
+            tasks = []
+            for entity, rows in enumerate(entity_rows):
+                entity_train_end, entity_test_end = np.searchsorted(rows, [train_end, test_end])
+                if entity_train_end > 0 and entity_test_end > entity_train_end:
+                    tasks.append((entity, entity_train_end, entity_test_end))
+            task_features = [entity_features[entity][:entity_test_end] for entity, _, entity_test_end in tasks]
+            task_labels = [entity_labels[entity][:entity_train_end] for entity, entity_train_end, _ in tasks]
+            if executor is None:
+                results = [fit_predict_fold(model_ref, hypers, *task) for task in zip(task_features, task_labels)]
+            else:
+                results = list(executor.map(fit_predict_fold, repeat(model_ref), repeat(hypers), task_features,
+                                            task_labels))
+
+            for (entity, entity_train_end, entity_test_end), (entity_prediction, *_) in zip(tasks, results):
+                predictions[entity_rows[entity][entity_train_end:entity_test_end]] = entity_prediction
+            end = time.perf_counter()
+
+            # Share of fit time summed over entities, as entities may have been fitted concurrently
+            fit_seconds = sum(fit_end - fit_start for _, fit_start, fit_end, _ in results)
+            total_seconds = sum(predict_end - fit_start for _, fit_start, _, predict_end in results)
+            fit_end = start + (end - start) * (fit_seconds / total_seconds if total_seconds > 0 else 1)
+            emit_fold(callbacks, fold, train_end, test_end - train_end, start, fit_end, end)
+            report_fold(trial, fold, labels[train_end:test_end], predictions[train_end:test_end], running_error)
+    finally:
+        if executor is not None:
+            # E.g. pruned, don't wait for remaining entities
+            executor.shutdown(wait=False, cancel_futures=True)
+    return predictions
+
+
+def emit_fold(callbacks, fold, train_rows, test_rows, start, fit_end, end):
+    emit(callbacks, 'fold', fold=fold, train_rows=train_rows, test_rows=test_rows, time=start,
+         duration=end - start, fit_time=fit_end - start, predict_time=end - fit_end)
 
-    if feature_list is None:
-        feature_list = [i for i in df.columns if i != label]
-
-    while split < df.index.date.max():
-        cv_train = df[:split]
-        cv_test = df.loc[df.index > cv_train.index.max()]
-        model.fit(
-            cv_train[feature_list],
-            cv_train[label],
-        )
-        df.loc[df.index.isin(cv_test.index), pred] = (
-            model.predict(cv_test[feature_list])
-        )
-        split += datetime.timedelta(days=step_days)
 
-    return df
+def report_fold(trial, fold, labels, fold_prediction, running_error):
+    if trial is None:
+        return
+    running_error['sum'] += np.nansum(np.abs(labels - fold_prediction))
+    running_error['count'] += np.count_nonzero(~np.isnan(fold_prediction))
+    trial.report(running_error['sum'] / max(running_error['count'], 1), step=fold)
+    if trial.should_prune():
+        import optuna
+        raise optuna.TrialPruned(f"Pruned after fold {fold}")
 
 
 def get_mae_from_cv_time_series(
@@ -46,11 +474,22 @@ def get_mae_from_cv_time_series(
         hypers: dict = {},
         pred: str = 'cv_pred',
         step_days: int = 10,
+        fold_plan: FoldPlan = None,
+        n_jobs: int = 1,
+        parallel_backend: str = 'thread',
+        incremental: bool = False,
+        callbacks: list = None,
+        trial=None,
+        feature_matrix: FeatureMatrix = None,
+        dataset_cache=None,
+        entity_col: str = None,
+        model_per_entity: bool = False,
+        fold_store=None,
 ) -> float:
 
     """ Wrapper for just getting MAE score from cv for time series """
 
-    df = cv_time_series(
+    result = cv_time_series(
         df=df,
         feature_list=feature_list,
         model_ref=model_ref,
@@ -58,7 +497,19 @@ def get_mae_from_cv_time_series(
         label=label,
         hypers=hypers,
         pred='cv_pred',
-        step_days=step_days
+        step_days=step_days,
+        fold_plan=fold_plan,
+        n_jobs=n_jobs,
+        parallel_backend=parallel_backend,
+        incremental=incremental,
+        callbacks=callbacks,
+        trial=trial,
+        feature_matrix=feature_matrix,
+        dataset_cache=dataset_cache,
+        as_frame=False,
+        entity_col=entity_col,
+        model_per_entity=model_per_entity,
+        fold_store=fold_store,
     )
 
-    return (df[label] - df[pred]).abs().mean()
+    return result.mae()
@@ -0,0 +1,160 @@
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+from ml_tools.lru import LRUDict, prune_files
+
+# Eval kwargs that change how a score is computed but not the score itself, left out of the key
+IGNORED_KWARGS = ('fold_plan', 'n_jobs', 'parallel_backend', 'callbacks', 'trial', 'fold_store')
+
+
+class EvalCache:
+
+    """ Memoizes scores from eval_func, so selectors don't pay twice for the same evaluation (e.g. the removing
+    strategy of FeatureSelector re-checking subsets, or the best train start of TrainStartSelector being the
+    baseline of the next stage in ModelAssumptionSelector). The key is the order-insensitive feature_list plus
+    a fingerprint of the other eval kwargs (with eval_func defaults filled in). A df is fingerprinted from its
+    shape, columns and index range, not its values, so the cache assumes data is not changed in place between
+    evaluations. Scores are kept in memory with LRU eviction, and optionally also written to cache_dir so they
+    survive between runs and processes. Files in cache_dir are not removed automatically, call prune to remove
+    the ones not used for keep_days. """
+
+    def __init__(
+            self,
+            max_size: int = 1024,  # Max number of scores to keep in memory, least recently used evicted first
+            cache_dir: str = None,  # Optional directory to also persist scores to, one json file per key
+    ):
+        assert max_size >= 1
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.scores = LRUDict(max_size)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def evaluate(self, eval_func, kwargs):
+        key = self.make_key(eval_func, kwargs)
+        score = self.get(key)
+        if score is None:
+            score = eval_func(**kwargs)
+            self.put(key, score)
+        return score
+
+    def make_key(self, eval_func, kwargs) -> str:
+        # Fill in defaults, so passing a default value explicitly or not gives the same key
+        try:
+            signature = inspect.signature(eval_func)
+            bound = signature.bind_partial(**kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            for name, parameter in signature.parameters.items():
+                if parameter.kind == inspect.Parameter.VAR_KEYWORD and name in arguments:
+                    arguments.update(arguments.pop(name))
+        except (TypeError, ValueError):
+            arguments = dict(kwargs)
+
+        for name in IGNORED_KWARGS:
+            arguments.pop(name, None)
+
+        feature_list = arguments.pop('feature_list', None)
+        features = None if feature_list is None else tuple(sorted(feature_list))
+        description = repr((fingerprint(eval_func), features, fingerprint(arguments)))
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, key: str):
+        if key in self.scores:
+            self.hits += 1
+            return self.scores.get(key)
+
+        if self.cache_dir is not None and os.path.exists(self.get_path(key)):
+            with open(self.get_path(key)) as f:
+                score = json.load(f)['score']
+            os.utime(self.get_path(key))  # Mark as used for prune
+            self.scores.put(key, score)
+            self.hits += 1
+            return score
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, score):
+        self.scores.put(key, score)
+        if self.cache_dir is not None:
+            # Write to temporary file first, so concurrent runs never read half written files
+            tmp_path = f"{self.get_path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'score': float(score)}, f)
+            os.replace(tmp_path, self.get_path(key))
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def prune(self, keep_days: float = 30) -> int:
+
+        """ Removes score files in cache_dir not written or read for keep_days, returns how many """
+
+        return 0 if self.cache_dir is None else prune_files(self.cache_dir, ('.json',), keep_days)
+
+    def clear(self):
+        # In memory only, see prune for cache_dir
+        self.scores.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.scores)}
+
+
+def fingerprint(value):
+
+    """ Cheap, hashable description of an eval kwarg value, used to key cached scores """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        index_range = (value.index[0], value.index[-1]) if len(value) else None
+        columns = tuple(value.columns) if isinstance(value, pd.DataFrame) else value.name
+        return type(value).__name__, value.shape, columns, repr(index_range)
+    if isinstance(value, dict):
+        return tuple(sorted(((str(k), fingerprint(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(repr(fingerprint(v)) for v in value))
+    if inspect.isfunction(value) and ('<lambda>' in value.__qualname__ or '<locals>' in value.__qualname__):
+        # Lambdas and closures of one factory share a qualname, so their code, defaults and closure values are
+        # part of the key (functions in the closure by name only, which also stops recursion)
+        closure = tuple(cell.cell_contents for cell in value.__closure__ or ())
+        return (f"{value.__module__}.{value.__qualname__}", fingerprint_code(value.__code__),
+                fingerprint(value.__defaults__), fingerprint(value.__kwdefaults__),
+                tuple(get_name(v) if inspect.isfunction(v) else fingerprint(v) for v in closure))
+    if isinstance(value, type) or inspect.isfunction(value):
+        return get_name(value)
+    return repr(value)
+
+
+def get_inputs_fingerprint(eval_func, kwargs: dict, settings=()) -> str:
+
+    """ Hash of what the results of a run depend on: eval_func, the eval kwargs (DataFrames also by the content, not
+    only their shape) and settings, e.g. of the selectors. Used to only resume stored studies and checkpoints on
+    the same inputs. Hashes the data once per call. """
+
+    arguments = {key: value for key, value in kwargs.items() if key not in IGNORED_KWARGS}
+    contents = {key: int(pd.util.hash_pandas_object(value).sum()) for key, value in arguments.items()
+                if isinstance(value, (pd.DataFrame, pd.Series))}
+    description = repr((fingerprint(eval_func), fingerprint(arguments), sorted(contents.items()),
+                        fingerprint(settings)))
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def get_name(value) -> str:
+    return f"{value.__module__}.{value.__qualname__}"
+
+
+def fingerprint_code(code) -> tuple:
+    # Bytecode, names and constants, with nested code objects (e.g. inner lambdas) in place of their address
+    constants = tuple(fingerprint_code(c) if inspect.iscode(c) else repr(c) for c in code.co_consts)
+    return code.co_code.hex(), code.co_names, constants
@@ -0,0 +1,150 @@
+import inspect
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml_tools.eval import FoldPlan, cv_time_series, emit_fold, get_feature_array
+from ml_tools.selector_base_classes import FeatureSelectorBase
+
+
+class FeatureRanker(FeatureSelectorBase):
+
+    """ Sorts feature_list from high to low importance, which FeatureSelector assumes (it tries features from the
+    start of the list when adding and from the end when removing), so it can then run with a small search_depth.
+    Fits model_ref once on each of n_folds evenly spaced cross-validation folds (as in cv_time_series), and ranks
+    by the model's own importances (method='model': gain for LightGBM, feature_importances_, or |coef_| times
+    feature std) or by permutation importance (method='permutation': increase in MAE on the rows after the fold's
+    split when one feature is shuffled, with all shuffled copies predicted in batches of up to max_batch_values
+    values). Importances are normalized per fold and averaged. method='auto' uses model importances where the
+    model has them. Reads the cross-validation arguments (df, model_ref, feature_list, hypers, cv_start, ...) from
+    the kwargs, with defaults from eval_func, but doesn't call eval_func itself. Use as a stage before
+    FeatureSelector in ModelAssumptionSelector, or as ranker of FeatureSelector. With a deadline (the time budget
+    of that stage), it stops between folds and ranks on the folds fitted so far, at least one. """
+
+    def __init__(
+            self,
+            method: str = 'auto',  # 'auto', 'model' or 'permutation'
+            n_folds: int = 3,  # Number of folds to fit the model on
+            n_repeats: int = 3,  # Shuffles per feature and fold when method is permutation
+            max_batch_values: int = 2 ** 24,  # Max size of stacked shuffled copies to predict in one call
+            seed: int = 0,
+            verbosity: float = 1,
+            callbacks: list = None,  # Optional callables receiving events, see ml_tools.instrumentation
+    ):
+        assert method in ['auto', 'model', 'permutation']
+        assert n_folds >= 1 and n_repeats >= 1
+        self.method = method
+        self.n_folds = n_folds
+        self.n_repeats = n_repeats
+        self.max_batch_values = max_batch_values
+        self.seed = seed
+        self.verbosity = verbosity
+        self.callbacks = callbacks
+        self.result_df = None
+
+    def run(
+            self,
+            eval_func,  # Only used for defaults of the cross-validation arguments
+            **kwargs,
+    ):
+        assert 'df' in kwargs and 'model_ref' in kwargs and kwargs.get('feature_list'), \
+            'FeatureRanker needs df, model_ref and feature_list in kwargs'
+        arguments = get_cv_arguments(eval_func, kwargs)
+        df, label, feature_list = arguments['df'], arguments['label'], list(arguments['feature_list'])
+
+        fold_plan = arguments.get('fold_plan')
+        if fold_plan is None or not fold_plan.matches(df.index, arguments['cv_start'], arguments['step_days']):
+            fold_plan = FoldPlan(df.index, cv_start=arguments['cv_start'], step_days=arguments['step_days'])
+        assert len(fold_plan) > 0, 'No cross-validation folds to rank features on'
+
+        features = get_feature_array(df, feature_list, arguments.get('feature_matrix'))
+        labels = df[label].to_numpy()
+        rng = np.random.default_rng(self.seed)
+
+        # Evenly spaced folds, each evaluated on the rows up to the next selected fold
+        selected = np.unique(np.linspace(0, len(fold_plan) - 1, min(self.n_folds, len(fold_plan))).round())
+        train_ends = fold_plan.train_ends[selected.astype(int)].tolist()
+        test_ends = train_ends[1:] + [len(df)]
+
+        fold_importances = []
+        for fold, (train_end, test_end) in enumerate(zip(train_ends, test_ends)):
+            if fold_importances and self.budget_exhausted():
+                break  # Rank on the folds fitted so far
+            start = time.perf_counter()
+            model = arguments['model_ref'](**arguments['hypers'])
+            model.fit(features[:train_end], labels[:train_end])
+            fit_end = time.perf_counter()
+
+            importances = None
+            if self.method != 'permutation':
+                importances = get_model_importances(model, features[:train_end])
+                assert importances is not None or self.method == 'auto', \
+                    f"{model.__class__.__name__} has no importances, use method='permutation'"
+            if importances is None:
+                importances = self.get_permutation_importances(
+                    model, features[train_end:test_end], labels[train_end:test_end], rng)
+
+            scale = np.abs(importances).sum()
+            fold_importances.append(importances / scale if scale > 0 else importances)
+            emit_fold(self.callbacks, fold, train_end, test_end - train_end, start, fit_end, time.perf_counter())
+
+        fold_importances = np.array(fold_importances)
+        self.result_df = pd.DataFrame({
+            'feature': feature_list,
+            'importance': fold_importances.mean(axis=0),
+            'importance_std': fold_importances.std(axis=0),
+        }).set_index('feature').sort_values('importance', ascending=False, kind='stable')
+
+        ranked_feature_list = list(self.result_df.index)
+        if self.verbosity >= 1:
+            print(f"FeatureRanker - Ranked features: {ranked_feature_list}")
+        return ranked_feature_list
+
+    def get_permutation_importances(self, model, features, labels, rng) -> np.ndarray:
+        n_rows, n_features = features.shape
+        baseline_error = np.mean(np.abs(labels - model.predict(features)))
+
+        # One (feature, repeat) copy of the rows per shuffle, stacked so each batch is one predict call
+        shuffles = [(feature, repeat) for feature in range(n_features) for repeat in range(self.n_repeats)]
+        batch_size = max(self.max_batch_values // max(n_rows * n_features, 1), 1)
+        errors = np.zeros((n_features, self.n_repeats))
+        for batch_start in range(0, len(shuffles), batch_size):
+            batch = shuffles[batch_start:batch_start + batch_size]
+            stacked = np.tile(features, (len(batch), 1))
+            for i, (feature, _) in enumerate(batch):
+                stacked[i * n_rows:(i + 1) * n_rows, feature] = features[rng.permutation(n_rows), feature]
+            predictions = np.asarray(model.predict(stacked)).reshape(len(batch), n_rows)
+            for (feature, repeat), error in zip(batch, np.mean(np.abs(predictions - labels), axis=1)):
+                errors[feature, repeat] = error
+        return errors.mean(axis=1) - baseline_error
+
+
+def get_cv_arguments(eval_func, kwargs: dict) -> dict:
+    # Cross-validation arguments from kwargs, with defaults of eval_func, then of cv_time_series
+    arguments = {name: parameter.default for name, parameter in inspect.signature(cv_time_series).parameters.items()
+                 if parameter.default is not inspect.Parameter.empty}
+    try:
+        bound = inspect.signature(eval_func).bind_partial(**kwargs)
+        bound.apply_defaults()
+        arguments.update(bound.arguments)
+    except (TypeError, ValueError):
+        pass
+    arguments.update(kwargs)
+    return arguments
+
+
+def get_model_importances(model, train_features):
+
+    """ Importance per feature from a fitted model, or None if it has none """
+
+    if hasattr(model, 'booster_'):
+        # LightGBM: total gain ranks better than the default split counts
+        return np.asarray(model.booster_.feature_importance(importance_type='gain'), dtype=float)
+    if hasattr(model, 'feature_importances_'):
+        return np.asarray(model.feature_importances_, dtype=float)
+    if hasattr(model, 'coef_'):
+        # Linear models: scale by feature spread, so the unit of a feature doesn't matter
+        coef = np.abs(np.asarray(model.coef_, dtype=float)).reshape(-1, train_features.shape[1]).sum(axis=0)
+        return coef * np.std(np.asarray(train_features, dtype=float), axis=0)
+    return None
@@ -1,6 +1,9 @@
+import contextlib
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from ml_tools.instrumentation import timed_eval_func
 from ml_tools.selector_base_classes import FeatureSelectorBase
 
 
@@ -16,7 +19,18 @@ class FeatureSelector(FeatureSelectorBase):
     features, the search stops and the best feature_list so far is returned.
     If feature_list is not sorted, the class can still be used to search through what features would
     improve vs not improve the score and return the best feature list by setting infinite patience to search
-    through all of them. """
+    through all of them.
+    The candidates of one iteration do not depend on each other, so with n_jobs != 1 (or an executor passed in)
+    they are scored concurrently. Scores are reduced in search order afterwards, so the result is the same as for
+    a serial run. Note that with a process pool, eval_func and its kwargs must be picklable.
+    With fidelities, the candidates of an iteration are first scored with cheaper proxies of eval_func, by
+    successive halving: each fidelity is a dict of kwargs to override (e.g. {'cv_start': later_date} for fewer
+    folds), or a callable returning such a dict from kwargs (e.g. for a row subsample), ordered cheap to expensive.
+    Only the best promote_fraction of candidates at one fidelity are scored at the next, and only those left after
+    the last are scored with the full kwargs and can be selected. This allows a larger search_depth on wide
+    feature sets at a fraction of the cost, at the risk of dropping a candidate the proxy ranks poorly.
+    With a ranker (see ml_tools.feature_ranker.FeatureRanker), feature_list is sorted by importance first, so it
+    doesn't need to be sorted by hand and a small search_depth is enough. """
 
     def __init__(
             self,
@@ -27,7 +41,15 @@ class FeatureSelector(FeatureSelectorBase):
             add_feature_threshold: float = 0.0001,  # When adding features, require small improvement in score
             verbosity: float = 1,
             remind_sorting: bool = True,
+            n_jobs: int = 1,  # How many candidates to score in parallel per iteration, -1 for all cores
+            executor=None,  # Optional concurrent.futures executor to use instead of a new process pool
+            cache=None,  # Optional EvalCache to skip combinations already scored, e.g. in earlier runs
+            callbacks: list = None,  # Optional callables receiving events, see ml_tools.instrumentation
+            fidelities: list = None,  # Optional cheap to expensive kwargs overrides to pre-screen candidates with
+            promote_fraction: float = 0.5,  # Share of candidates promoted from one fidelity to the next
+            ranker=None,  # Optional FeatureRanker to sort feature_list by importance before searching
     ):
+        assert 0 < promote_fraction <= 1, 'promote_fraction must be in (0, 1]'
 
         self.direction = direction
         self.strategy = strategy
@@ -36,6 +58,13 @@ class FeatureSelector(FeatureSelectorBase):
         self.add_feature_threshold = add_feature_threshold
         self.verbosity = verbosity
         self.remind_sorting = remind_sorting
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.cache = cache
+        self.callbacks = callbacks
+        self.fidelities = fidelities or []
+        self.promote_fraction = promote_fraction
+        self.ranker = ranker
         self.result_df = None
 
     def run(
@@ -43,10 +72,17 @@ class FeatureSelector(FeatureSelectorBase):
             eval_func,  # Should get a score to minimize or maximize, e.g. from cross-validation
             **kwargs,  # Set all arguments to eval_func when falling
     ):
-        if self.remind_sorting:
+        if self.remind_sorting and self.ranker is None:
             self.print_sorting_reminder()
 
         self.assert_consistency(eval_func, kwargs)
+        if self.ranker is not None:
+            # Ranking counts towards the time budget of this stage
+            self.ranker.deadline = self.deadline
+            try:
+                kwargs = {**kwargs, 'feature_list': self.ranker.run(eval_func, **kwargs)}
+            finally:
+                self.ranker.deadline = None
         list_of_dicts = []
 
         # Get baseline score for all features, no selection
@@ -57,54 +93,73 @@ class FeatureSelector(FeatureSelectorBase):
         patience_counter, remaining_features_list, selected_features_list = (
             self.init_variables(feature_list=kwargs['feature_list']))
 
-        # Use strict > 1 here to avoid double calculating scenario of all features
-        while len(remaining_features_list) > 1:
-            best_feature, best_score, global_improvement = self.reset_variables_current_trial()
+        with self.candidate_executor() as executor:
 
-            # Gets beginning of list if adding, end of list if removing
-            search_feature_list = self.get_search_feature_list(remaining_features_list)
-
-            for feature in search_feature_list:
-                if self.verbosity >= 2:
-                    print(f"{self.strategy} feature {feature}")
-
-                # Update feature combination based on strategy (removing vs adding the feature)
-                feature_combination_list = self.update_current_feature_combination(feature, selected_features_list)
-
-                # Add current feature combination to input kwargs to scoring function
-                kwargs['feature_list'] = feature_combination_list
-
-                # Get score for current iteration
-                current_score = eval_func(**kwargs)
-
-                # Update local variables if improvement this iteration
-                best_feature, best_score = self.update_local_variables(current_score, best_score, feature, best_feature)
-
-                # Update global variables if global improvement of score
-                best_feature_list, global_best_score, global_improvement = self.update_global_variables(
-                    current_score, feature_combination_list, global_best_score, global_improvement, feature,
-                    best_feature_list)
-
-            # Check patience vs global improvement (if no improvement for too many rounds, stop search)
-            if global_improvement:
-                patience_counter = 0
-            else:
-                patience_counter += 1
-                if patience_counter > self.patience:
+            # Use strict > 1 here to avoid double calculating scenario of all features
+            while len(remaining_features_list) > 1:
+                if self.budget_exhausted():
+                    if self.verbosity >= 1:
+                        print("FeatureSelector - Time budget used up, stopping search")
                     break
 
-            # Update feature lists
-            self.update_feature_lists(best_feature, remaining_features_list, selected_features_list)
+                best_feature, best_score, global_improvement = self.reset_variables_current_trial()
 
-            if self.verbosity >= 1.5:
-                print('\n', f"Finalizing iteration: Best score: {round(best_score, 4)} "
-                      f"with features {selected_features_list}")
+                # Gets beginning of list if adding, end of list if removing
+                search_feature_list = self.get_search_feature_list(remaining_features_list)
 
-            # Append best score for current number of features
-            list_of_dicts.append({'num_features': len(feature_combination_list),
-                                  'score': best_score})
+                # Update feature combination based on strategy (removing vs adding the feature)
+                feature_combinations = [self.update_current_feature_combination(feature, selected_features_list)
+                                        for feature in search_feature_list]
+
+                # Get scores for all candidates of current iteration (concurrently if executor)
+                scores = self.evaluate_candidates(eval_func, kwargs, feature_combinations, executor)
+
+                # Reduce in search order, so result is the same as when scoring one candidate at a time
+                for feature, feature_combination_list, current_score in zip(
+                        search_feature_list, feature_combinations, scores):
+                    if current_score is None:
+                        continue  # Not promoted to full fidelity, or not scored before the deadline
+                    if self.verbosity >= 2:
+                        print(f"{self.strategy} feature {feature}")
+
+                    # Update local variables if improvement this iteration
+                    best_feature, best_score = self.update_local_variables(
+                        current_score, best_score, feature, best_feature)
+
+                    # Update global variables if global improvement of score
+                    best_feature_list, global_best_score, global_improvement = self.update_global_variables(
+                        current_score, feature_combination_list, global_best_score, global_improvement, feature,
+                        best_feature_list)
+
+                if best_feature is None:
+                    if self.verbosity >= 1:
+                        print("FeatureSelector - Time budget used up, stopping search")
+                    break  # No candidate scored before the deadline
+
+                # Check patience vs global improvement (if no improvement for too many rounds, stop search)
+                if global_improvement:
+                    patience_counter = 0
+                else:
+                    patience_counter += 1
+                    if patience_counter > self.patience:
+                        break
+
+                # Update feature lists
+                self.update_feature_lists(best_feature, remaining_features_list, selected_features_list)
+
+                if self.verbosity >= 1.5:
+                    print('\n', f"Finalizing iteration: Best score: {round(best_score, 4)} "
+                          f"with features {selected_features_list}")
+
+                # Append best score for current number of features
+                list_of_dicts.append({'num_features': len(feature_combination_list),
+                                      'score': best_score})
 
         # Print out final result of search
+        if self.verbosity >= 1 and self.cache is not None:
+            print(f"FeatureSelector - Evaluation cache: {self.cache.stats}")
+        if self.verbosity >= 1 and kwargs.get('dataset_cache') is not None:
+            print(f"FeatureSelector - Dataset cache: {kwargs['dataset_cache'].stats}")
         if self.verbosity >= 1:
             print(f"FeatureSelector - Final best score: {round(global_best_score, 3)} "
                   f"with features: {best_feature_list}")
@@ -115,6 +170,89 @@ class FeatureSelector(FeatureSelectorBase):
 
         return best_feature_list
 
+    @contextlib.contextmanager
+    def candidate_executor(self):
+        if self.executor is not None:
+            yield self.executor
+        elif self.n_jobs == 1:
+            yield None
+        else:
+            # Reuse one pool for the whole run to not pay process startup every iteration
+            max_workers = None if self.n_jobs == -1 else self.n_jobs
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                yield executor
+
+    def evaluate_candidates(self, eval_func, kwargs, feature_combinations, executor=None):
+        # Returns full fidelity score per combination, None for combinations not promoted to full fidelity
+        promoted = list(range(len(feature_combinations)))
+        for fidelity in self.fidelities:
+            if len(promoted) <= 1:
+                break
+            fidelity_kwargs = {**kwargs, **(fidelity(kwargs) if callable(fidelity) else fidelity)}
+            proxy_scores = self.score_combinations(
+                eval_func, fidelity_kwargs, [feature_combinations[i] for i in promoted], executor)
+            promoted = self.get_promoted(promoted, proxy_scores)
+
+        scores = [None] * len(feature_combinations)
+        full_scores = self.score_combinations(
+            eval_func, kwargs, [feature_combinations[i] for i in promoted], executor)
+        for i, score in zip(promoted, full_scores):
+            scores[i] = score
+        return scores
+
+    def get_promoted(self, candidates, scores):
+        # Best promote_fraction of candidates (NaN scores and candidates not scored before the deadline last), kept
+        # in search order
+        scores = [np.nan if score is None else score for score in scores]
+        n_promoted = max(int(np.ceil(len(candidates) * self.promote_fraction)), 1)
+        sign = 1 if self.direction == 'minimize' else -1
+        ranking = sorted(range(len(candidates)), key=lambda j: (np.isnan(scores[j]), sign * scores[j]))
+        promoted = sorted(candidates[j] for j in ranking[:n_promoted])
+        if self.verbosity >= 2:
+            print(f"Promoting {len(promoted)} of {len(candidates)} candidates to next fidelity")
+        return promoted
+
+    def score_combinations(self, eval_func, kwargs, feature_combinations, executor=None):
+        candidate_kwargs = [{**kwargs, 'feature_list': combination} for combination in feature_combinations]
+        if executor is None:
+            # Callbacks can't report back from worker processes, so only forward them when scoring in process
+            candidate_kwargs = [self.forward_callbacks(eval_func, current_kwargs)
+                                for current_kwargs in candidate_kwargs]
+
+        # Only score the combinations that are not already cached
+        if self.cache is None:
+            keys = [None] * len(candidate_kwargs)
+            scores = [None] * len(candidate_kwargs)
+        else:
+            keys = [self.cache.make_key(eval_func, current_kwargs) for current_kwargs in candidate_kwargs]
+            scores = [self.cache.get(key) for key in keys]
+        for current_kwargs, score in zip(candidate_kwargs, scores):
+            if score is not None:
+                self.emit_evaluation(current_kwargs, score, time.perf_counter(), 0.0, cached=True)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        results = self.map_eval_func(eval_func, [candidate_kwargs[i] for i in missing], executor)
+        for i, (score, start, duration) in zip(missing, results):
+            if self.cache is not None:
+                self.cache.put(keys[i], score)
+            self.emit_evaluation(candidate_kwargs[i], score, start, duration)
+            scores[i] = score
+        return scores
+
+    def map_eval_func(self, eval_func, candidate_kwargs, executor=None):
+        # Returns (score, start, duration) per candidate. One at a time it stops at the deadline, so candidates at
+        # the end can be left without result, while candidates scored concurrently all finish.
+        if executor is None or len(candidate_kwargs) <= 1:
+            results = []
+            for current_kwargs in candidate_kwargs:
+                if self.budget_exhausted():
+                    break
+                results.append(timed_eval_func(eval_func, current_kwargs))
+            return results
+
+        # map returns scores in submission order, regardless of which candidate finishes first
+        return list(executor.map(timed_eval_func, [eval_func] * len(candidate_kwargs), candidate_kwargs))
+
     def print_sorting_reminder(self):
         print("For FeatureSelector, note that the feature_list int kwargs needs to be sorted from high "
               "presumed importance to low, for the search to work properly (unless search_depth >= "
@@ -129,7 +267,7 @@ class FeatureSelector(FeatureSelectorBase):
         assert self.strategy in ['adding', 'removing']
 
     def run_baseline_all_features(self, eval_func, kwargs, list_of_dicts):
-        current_score = eval_func(**kwargs)
+        current_score = self.evaluate(eval_func, kwargs)
         if self.verbosity >= 1:
             print("Baseline score with all features", round(current_score, 4))
         list_of_dicts.append({'num_features': len(kwargs['feature_list']),
@@ -206,6 +344,7 @@ class FeatureSelector(FeatureSelectorBase):
         return best_feature, best_score
 
     def plot_result(self):
+        import matplotlib.pyplot as plt  # Optional plot dependency, imported here to keep import fast
         assert self.result_df is not None, 'No result yet to plot'
         self.result_df.plot(), plt.show()
 
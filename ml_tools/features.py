@@ -0,0 +1,169 @@
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from ml_tools.eval_cache import fingerprint
+from ml_tools.lru import LRUDict
+
+# Calendar parts by name, computed from a DatetimeIndex
+CALENDAR_PARTS = {
+    'hour': lambda index: index.hour,
+    'dow': lambda index: index.weekday,
+    'dom': lambda index: index.day,
+    'doy': lambda index: index.dayofyear,
+    'week': lambda index: index.isocalendar().week.to_numpy(dtype=np.int64),
+    'month': lambda index: index.month,
+    'quarter': lambda index: index.quarter,
+    'year': lambda index: index.year,
+    'is_weekend': lambda index: index.weekday >= 5,
+}
+
+# Seasonal periods in days, for Fourier terms given by name
+PERIOD_DAYS = {'day': 1, 'week': 7, 'year': 365.25}
+
+ROLLING_STATS = ('mean', 'std', 'min', 'max', 'sum', 'median')
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 1e9
+
+
+class FeatureBuilder:
+
+    """ Builds features from a declarative spec, vectorized over the index and columns of df, e.g:
+    spec = {
+        'calendar': ['hour', 'dow', 'doy'],  # See CALENDAR_PARTS
+        'fourier': [{'period': 'year', 'order': 3}, {'period': 7, 'order': 2}],  # Period by name or in days
+        'lags': {'label': [24, 168]},  # Column values shifted by that many rows (per entity)
+        'rolling': {'label': {'windows': [24, 168], 'stats': ['mean', 'std'], 'shift': 24}},
+    }
+    Fourier terms are sin and cos of time since epoch, so their values don't depend on where df starts. Lags and
+    rolling windows are in rows, per entity if entity_col is set (long format panel sorted by time), and rolling
+    windows are over the column shifted by shift rows (default 1). For honest cross-validation, lags and shifts
+    should be at least the forecast horizon. Features are cached per (df fingerprint incl. the values of the lag
+    and rolling source columns, spec), so FeatureSelector runs or a rerun pipeline don't recompute them. """
+
+    def __init__(
+            self,
+            spec: dict,
+            entity_col: str = None,  # Optional entity column of a panel, to compute lags and rolling per entity
+            dtype: str = 'float64',  # E.g. 'float32' to halve memory of many generated features
+            max_size: int = 8,  # Max number of feature frames to keep, least recently used evicted first
+    ):
+        unknown_keys = set(spec) - {'calendar', 'fourier', 'lags', 'rolling'}
+        assert not unknown_keys, f"Unknown feature spec keys {unknown_keys}"
+        for part in spec.get('calendar', []):
+            assert part in CALENDAR_PARTS, f"Unknown calendar part {part}, use one of {list(CALENDAR_PARTS)}"
+        for term in spec.get('fourier', []):
+            assert term['period'] in PERIOD_DAYS or isinstance(term['period'], (int, float)), \
+                f"Unknown period {term['period']}, use days or one of {list(PERIOD_DAYS)}"
+        for lags in spec.get('lags', {}).values():
+            assert all(lag >= 1 for lag in lags), 'Lags must be at least 1 row, to not leak the current value'
+        for rolling in spec.get('rolling', {}).values():
+            assert set(rolling.get('stats', ['mean'])) <= set(ROLLING_STATS), f"Rolling stats are {ROLLING_STATS}"
+            assert rolling.get('shift', 1) >= 1, 'Rolling shift must be at least 1 row, to not leak the current value'
+        self.spec = spec
+        self.entity_col = entity_col
+        self.dtype = dtype
+        self.max_size = max_size
+        self.features = LRUDict(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def feature_names(self) -> list:
+        names = list(self.spec.get('calendar', []))
+        for term in self.spec.get('fourier', []):
+            for k in range(1, term.get('order', 1) + 1):
+                names += [f"fourier_{term['period']}_sin_{k}", f"fourier_{term['period']}_cos_{k}"]
+        for source, lags in self.spec.get('lags', {}).items():
+            names += [f"{source}_lag_{lag}" for lag in lags]
+        for source, rolling in self.spec.get('rolling', {}).items():
+            names += [f"{source}_rolling_{stat}_{window}"
+                      for window in rolling['windows'] for stat in rolling.get('stats', ['mean'])]
+        return names
+
+    def build(self, df: pd.DataFrame) -> pd.DataFrame:
+
+        """ Copy of df with the features added """
+
+        features = self.get_features(df)
+        return pd.concat([df.drop(columns=[c for c in features.columns if c in df.columns]), features], axis=1)
+
+    def get_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        key = self.make_key(df)
+        if key in self.features:
+            self.hits += 1
+            return self.features.get(key)
+
+        self.misses += 1
+        features = self.compute_features(df)
+        self.features.put(key, features)
+        return features
+
+    def make_key(self, df: pd.DataFrame) -> str:
+        # Lags and rolling windows depend on the values of their source columns, the rest only on the index
+        sources = sorted(set(self.spec.get('lags', {})) | set(self.spec.get('rolling', {})))
+        if self.entity_col is not None:
+            sources.append(self.entity_col)
+        index_hash = int(pd.util.hash_pandas_object(df.index).sum())
+        source_hash = int(pd.util.hash_pandas_object(df[sources], index=False).sum()) if sources else None
+        description = repr((fingerprint(df), index_hash, source_hash, self.entity_col, self.dtype,
+                            json.dumps(self.spec, sort_keys=True, default=str)))
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def compute_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        index = df.index
+        assert isinstance(index, pd.DatetimeIndex), 'FeatureBuilder needs a DatetimeIndex'
+        columns = {}
+        for part in self.spec.get('calendar', []):
+            columns[part] = np.asarray(CALENDAR_PARTS[part](index))
+
+        days = index.asi8 / NANOSECONDS_PER_DAY
+        for term in self.spec.get('fourier', []):
+            period_days = PERIOD_DAYS.get(term['period'], term['period'])
+            for k in range(1, term.get('order', 1) + 1):
+                angle = 2 * np.pi * k * days / period_days
+                columns[f"fourier_{term['period']}_sin_{k}"] = np.sin(angle)
+                columns[f"fourier_{term['period']}_cos_{k}"] = np.cos(angle)
+
+        codes = pd.factorize(df[self.entity_col])[0] if self.entity_col is not None else None
+        for source, lags in self.spec.get('lags', {}).items():
+            for lag in lags:
+                columns[f"{source}_lag_{lag}"] = shift_values(df[source].to_numpy(), lag, codes)
+        for source, rolling in self.spec.get('rolling', {}).items():
+            shifted = shift_values(df[source].to_numpy(), rolling.get('shift', 1), codes)
+            for window in rolling['windows']:
+                for stat in rolling.get('stats', ['mean']):
+                    columns[f"{source}_rolling_{stat}_{window}"] = rolling_values(
+                        shifted, window, stat, codes, rolling.get('min_periods'))
+
+        return pd.DataFrame(columns, index=index, columns=self.feature_names).astype(self.dtype)
+
+    def clear(self):
+        self.features.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.features)}
+
+
+def shift_values(values: np.ndarray, periods: int, codes: np.ndarray = None) -> np.ndarray:
+    # Positional, so duplicate timestamps of a panel don't matter
+    series = pd.Series(values, dtype=np.float64)
+    if codes is None:
+        return series.shift(periods).to_numpy()
+    return series.groupby(codes).shift(periods).to_numpy()
+
+
+def rolling_values(values: np.ndarray, window: int, stat: str, codes: np.ndarray = None,
+                   min_periods: int = None) -> np.ndarray:
+    series = pd.Series(values)
+    if codes is None:
+        return getattr(series.rolling(window, min_periods=min_periods), stat)().to_numpy()
+
+    # Grouped result is ordered by entity, back to row order by position
+    result = getattr(series.groupby(codes).rolling(window, min_periods=min_periods), stat)()
+    return result.droplevel(0).sort_index().to_numpy()
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml_tools.eval import emit_fold, report_fold
+from ml_tools.eval_cache import fingerprint
+from ml_tools.lru import LRUDict, prune_files
+
+# Multiplier to combine column hashes of a row, order sensitive (as in pandas' hash_pandas_object)
+HASH_MULTIPLIER = np.uint64(1000003)
+
+
+class FoldStore:
+
+    """ Keeps cross-validation predictions per fold, for reruns on data that mostly stayed the same, e.g. a daily
+    ModelAssumptionSelector run after appending a day of data. Pass it as fold_store to cv_time_series /
+    get_mae_from_cv_time_series (also via the kwargs of the selectors). A fold is keyed by model_ref, hypers,
+    feature_list, label and a hash of the content of its training rows (which covers train start and fold
+    boundary) and test rows. On rerun, a fold whose training and test rows are unchanged reuses its predictions,
+    a fold with the same training rows but more test rows (the last fold, as data is appended) reuses its fitted
+    model and only predicts, and only new or changed folds are fitted. Selection cost then grows with the new
+    data rather than with all history. Scores are the same as without the store, for deterministic models.
+    With cache_dir, predictions and models are also written there, so they survive between runs. Predictions and
+    fitted models are kept in memory with LRU eviction, up to max_predictions folds and max_models models. Files
+    in cache_dir are not removed automatically, call prune to remove the ones not used for keep_days (e.g. after
+    each daily run). Only used for sequential folds (n_jobs=1, incremental=False). """
+
+    def __init__(
+            self,
+            cache_dir: str = None,  # Optional directory to persist predictions and models in
+            max_models: int = 64,  # Max number of fitted models to keep in memory
+            max_predictions: int = 1024,  # Max number of fold predictions to keep in memory
+            store_models: bool = True,  # Keep fitted models, to only predict when just the test rows changed
+    ):
+        self.cache_dir = cache_dir
+        self.max_models = max_models
+        self.max_predictions = max_predictions
+        self.store_models = store_models
+        self.predictions = LRUDict(max_predictions)
+        self.models = LRUDict(max_models)
+        self.fitted = 0
+        self.predicted = 0
+        self.reused = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return f"FoldStore(cache_dir={self.cache_dir!r})"
+
+    def predict_folds(self, df, model_ref, feature_list, label, hypers, features, labels, folds, callbacks=None,
+                      trial=None):
+
+        """ Predictions for the test rows of every fold, fitting only folds not in the store """
+
+        description = repr((fingerprint(model_ref), fingerprint(hypers), tuple(feature_list), label))
+        # Prefix sums, so the hash of any row range is a difference (overflow wraps around)
+        row_hashes = np.concatenate([[np.uint64(0)], np.cumsum(get_row_hashes(df.index, features, labels))])
+
+        predictions = np.full(len(labels), np.nan)
+        running_error = {'sum': 0.0, 'count': 0}
+        for fold, (train_end, test_end) in enumerate(folds):
+            start = time.perf_counter()
+            with np.errstate(over='ignore'):
+                test_hash = row_hashes[test_end] - row_hashes[train_end]
+            train_key = get_key(description, train_end, row_hashes[train_end])
+            fold_key = get_key(train_key, test_end - train_end, test_hash)
+
+            fold_prediction = self.get_predictions(fold_key)
+            fit_end = time.perf_counter()
+            if fold_prediction is None:
+                model = self.get_model(train_key)
+                if model is None:
+                    model = model_ref(**hypers)
+                    model.fit(features[:train_end], labels[:train_end])
+                    self.put_model(train_key, model)
+                    self.fitted += 1
+                else:
+                    self.predicted += 1
+                fit_end = time.perf_counter()
+                fold_prediction = np.asarray(model.predict(features[train_end:test_end]), dtype=np.float64)
+                self.put_predictions(fold_key, fold_prediction)
+            else:
+                self.reused += 1
+
+            predictions[train_end:test_end] = fold_prediction
+            emit_fold(callbacks, fold, train_end, test_end - train_end, start, fit_end, time.perf_counter())
+            report_fold(trial, fold, labels[train_end:test_end], fold_prediction, running_error)
+        return predictions
+
+    def get_predictions(self, key: str):
+        if key in self.predictions:
+            return self.predictions.get(key)
+        if self.cache_dir is not None and os.path.exists(self.get_path(key, 'npy')):
+            fold_prediction = np.load(self.get_path(key, 'npy'))
+            os.utime(self.get_path(key, 'npy'))  # Mark as used for prune
+            self.predictions.put(key, fold_prediction)
+            return fold_prediction
+        return None
+
+    def put_predictions(self, key: str, fold_prediction: np.ndarray):
+        self.predictions.put(key, fold_prediction)
+        if self.cache_dir is not None:
+            # Write to temporary file first, so concurrent runs never read half written files
+            tmp_path = f"{self.get_path(key, 'npy')}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, fold_prediction)
+            os.replace(tmp_path, self.get_path(key, 'npy'))
+
+    def get_model(self, key: str):
+        if not self.store_models:
+            return None
+        if key in self.models:
+            return self.models.get(key)
+        if self.cache_dir is not None and os.path.exists(self.get_path(key, 'pkl')):
+            with open(self.get_path(key, 'pkl'), 'rb') as f:
+                model = pickle.load(f)
+            os.utime(self.get_path(key, 'pkl'))
+            self.models.put(key, model)
+            return model
+        return None
+
+    def put_model(self, key: str, model):
+        if not self.store_models:
+            return
+        self.models.put(key, model)
+        if self.cache_dir is not None:
+            tmp_path = f"{self.get_path(key, 'pkl')}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(model, f)
+            os.replace(tmp_path, self.get_path(key, 'pkl'))
+
+    def get_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{extension}")
+
+    def prune(self, keep_days: float = 7) -> int:
+
+        """ Removes prediction and model files in cache_dir not written or read for keep_days, returns how many """
+
+        return 0 if self.cache_dir is None else prune_files(self.cache_dir, ('.npy', '.pkl'), keep_days)
+
+    def clear(self):
+        # In memory only, see prune for cache_dir
+        self.predictions.clear()
+        self.models.clear()
+        self.fitted = 0
+        self.predicted = 0
+        self.reused = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'fitted': self.fitted, 'predicted': self.predicted, 'reused': self.reused}
+
+
+def get_row_hashes(index: pd.Index, features: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    # One uint64 per row from timestamp, features and label, vectorized per column (overflow wraps around)
+    row_hashes = pd.util.hash_pandas_object(index).to_numpy()
+    with np.errstate(over='ignore'):
+        for column in range(features.shape[1]):
+            row_hashes = row_hashes * HASH_MULTIPLIER ^ pd.util.hash_array(np.ascontiguousarray(features[:, column]))
+        row_hashes = row_hashes * HASH_MULTIPLIER ^ pd.util.hash_array(np.asarray(labels))
+    return row_hashes
+
+
+def get_key(*parts) -> str:
+    return hashlib.sha1(repr(tuple(int(part) if isinstance(part, np.integer) else part
+                                   for part in parts)).encode()).hexdigest()
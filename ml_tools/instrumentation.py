@@ -0,0 +1,115 @@
+import json
+import time
+
+import pandas as pd
+
+
+class EventRecorder:
+
+    """ Callback that collects the structured events emitted by the selectors, ModelAssumptionSelector and
+    cv_time_series, to see which stage and which candidates dominate runtime. Pass it in callbacks=[recorder]
+    to the selectors (and to the eval kwargs, or let the selectors forward it, for fold level fit/predict times).
+    Event types are:
+    - stage_start / stage_end: a selector stage of ModelAssumptionSelector, stage_end has duration
+    - candidate_evaluated: one eval_func call, with score, duration, whether it was a cache hit, and the candidate
+    - fold: one cross-validation fold, with fit_time and predict_time
+    Events without a stage get the stage currently running. """
+
+    def __init__(self):
+        self.events = []
+        self.stage = None
+
+    def __call__(self, event: dict):
+        if event['event'] == 'stage_start':
+            self.stage = event['stage']
+        event = {'stage': self.stage, **event}
+        self.events.append(event)
+        if event['event'] == 'stage_end':
+            self.stage = None
+
+    def to_frame(self, event: str = None) -> pd.DataFrame:
+        df = pd.DataFrame(self.events)
+        if event is not None and len(df):
+            df = df.loc[df['event'] == event].dropna(axis=1, how='all').reset_index(drop=True)
+        return df
+
+    def summary(self) -> pd.DataFrame:
+
+        """ Evaluations per stage: count, cache hits, total and mean wall time, best and worst score """
+
+        df = self.to_frame('candidate_evaluated')
+        if not len(df):
+            return df
+        return df.groupby('stage', sort=False).agg(
+            n_evals=('duration', 'size'),
+            cache_hits=('cached', 'sum'),
+            total_time=('duration', 'sum'),
+            mean_time=('duration', 'mean'),
+            min_score=('score', 'min'),
+            max_score=('score', 'max'),
+        )
+
+    def to_chrome_trace(self, path: str):
+
+        """ Export as Chrome trace JSON, open in chrome://tracing or https://ui.perfetto.dev """
+
+        if not self.events:
+            trace_events = []
+        else:
+            t0 = min(event['time'] for event in self.events)
+            trace_events = [get_trace_event(event, t0) for event in self.events if event['event'] != 'stage_start']
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+def get_trace_event(event: dict, t0: float) -> dict:
+    # Stages on one row, evaluations on the next and folds below, spans start at event time
+    tids = {'stage_end': 0, 'candidate_evaluated': 1, 'fold': 2}
+    name = event['event'] if event['event'] != 'stage_end' else event['stage']
+    if event['event'] == 'fold':
+        name = f"fold {event['fold']}"
+    args = {k: v for k, v in event.items() if k not in ['event', 'time', 'duration']}
+    trace_event = {
+        'name': str(name),
+        'cat': event['event'],
+        'ts': (event['time'] - t0) * 1e6,
+        'pid': 0,
+        'tid': tids.get(event['event'], 3),
+        'args': args,
+    }
+    if 'duration' in event:
+        trace_event.update({'ph': 'X', 'dur': event['duration'] * 1e6})
+    else:
+        trace_event.update({'ph': 'i', 's': 't'})
+    return trace_event
+
+
+def emit(callbacks, event: str, **fields):
+
+    """ Send event to all callbacks, time is when the event (or span, if it has a duration) started """
+
+    if not callbacks:
+        return
+    fields.setdefault('time', time.perf_counter())
+    for callback in callbacks:
+        callback({'event': event, **fields})
+
+
+def describe_candidate(kwargs: dict) -> dict:
+    # What is being evaluated, in the terms of the selectors
+    description = {}
+    if kwargs.get('feature_list') is not None:
+        description['n_features'] = len(kwargs['feature_list'])
+        description['feature_list'] = list(kwargs['feature_list'])
+    if 'hypers' in kwargs:
+        description['hypers'] = dict(kwargs['hypers'])
+    if 'df' in kwargs and len(kwargs['df']):
+        description['train_start'] = kwargs['df'].index[0]
+    return description
+
+
+def timed_eval_func(eval_func, kwargs):
+    # Module level so it can be pickled to worker processes
+    start = time.perf_counter()
+    score = eval_func(**kwargs)
+    return score, start, time.perf_counter() - start
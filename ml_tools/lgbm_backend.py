@@ -0,0 +1,150 @@
+import threading
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from ml_tools.eval import FeatureMatrix, emit_fold, report_fold
+from ml_tools.lru import LRUDict
+
+# Hypers (LightGBM and sklearn API names) that decide the binning, so they are fixed once a Dataset is constructed
+BINNING_PARAMS = ('max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'subsample_for_bin', 'bin_construct_sample_cnt',
+                  'feature_pre_filter', 'use_missing', 'zero_as_missing')
+
+# sklearn API arguments that are not LightGBM parameters
+SKLEARN_ONLY_PARAMS = ('n_estimators', 'importance_type', 'class_weight', 'silent')
+
+
+class LGBMDatasetCache:
+
+    """ LightGBM evaluation backend for cv_time_series, to not re-bin the same raw columns in every evaluation.
+    The binned lgb.Dataset of each fold's training rows is constructed once over all candidate features
+    (feature_list), and a feature subset is trained on that with interaction_constraints limited to the subset,
+    so the other columns are never split on. Pass it as dataset_cache to cv_time_series /
+    get_mae_from_cv_time_series (also via the kwargs of the selectors), for df or any contiguous row slice of it.
+    Only used for LGBMRegressor model_ref, sequential folds (n_jobs=1, incremental=False) and hypers that don't
+    change the binning (see BINNING_PARAMS, set those in dataset_params instead), other evaluations take the
+    generic path. Scores can differ slightly from the generic path, since feature bundling and histogram
+    construction see all columns. Constructed datasets are kept in memory with LRU eviction, and stats reports
+    the construction time saved by reusing them (an upper bound, since a subset has fewer columns to bin). """
+
+    def __init__(
+            self,
+            df: pd.DataFrame,
+            feature_list: list,  # All candidate features, e.g. the feature_list given to FeatureSelector
+            label: str = 'label',
+            dataset_params: dict = None,  # Optional lgb.Dataset parameters, e.g. {'max_bin': 63}
+            max_size: int = 256,  # Max number of fold datasets to keep, least recently used evicted first
+    ):
+        self.feature_list = list(feature_list)
+        self.label = label
+        self.feature_matrix = FeatureMatrix(df, columns=self.feature_list)
+        self.labels = df[label].to_numpy(dtype=np.float64)
+
+        # No pre-filtering of features, so min_child_samples can still vary between evaluations on one Dataset
+        self.dataset_params = {'feature_pre_filter': False, 'verbose': -1, **(dataset_params or {})}
+        self.max_size = max_size
+        self.datasets = LRUDict(max_size)
+        self.lock = threading.Lock()
+        self.construct_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.reuses = 0
+        self.fallbacks = 0
+
+    def __repr__(self):
+        # Deterministic, so it's part of EvalCache keys
+        return (f"LGBMDatasetCache({self.feature_matrix!r}, label={self.label!r}, "
+                f"dataset_params={self.dataset_params!r})")
+
+    def __getstate__(self):
+        # Dataset handles can't be pickled, so worker processes construct their own
+        state = self.__dict__.copy()
+        state['datasets'] = LRUDict(self.max_size)
+        state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def supports(self, model_ref, hypers: dict, feature_list: list, label: str) -> bool:
+        if not (isinstance(model_ref, type) and issubclass(model_ref, lgb.LGBMRegressor)):
+            return False
+        if label != self.label or not self.feature_matrix.covers(feature_list):
+            return False
+        return all(self.dataset_params.get(key) == value for key, value in hypers.items() if key in BINNING_PARAMS)
+
+    def predict_folds(self, df, model_ref, feature_list, label, hypers, fold_plan, callbacks=None, trial=None):
+
+        """ Predictions for the test rows of every fold, or None if this cache can't evaluate the inputs """
+
+        row_offset = self.feature_matrix.row_offset(df)
+        if row_offset is None or not self.supports(model_ref, hypers, feature_list, label):
+            self.fallbacks += 1
+            return None
+
+        params, num_boost_round = self.get_train_params(model_ref, hypers)
+        if set(feature_list) != set(self.feature_list):
+            # Features not in any constraint are never split on
+            params['interaction_constraints'] = [sorted(self.feature_matrix.column_positions[feature]
+                                                        for feature in feature_list)]
+
+        labels = df[label].to_numpy()
+        predictions = np.full(len(df), np.nan)
+        running_error = {'sum': 0.0, 'count': 0}
+        for fold, (train_end, test_end) in enumerate(fold_plan.folds()):
+            start = time.perf_counter()
+            train_set = self.get_train_set(row_offset, row_offset + train_end)
+            booster = lgb.train(params, train_set, num_boost_round=num_boost_round)
+            fit_end = time.perf_counter()
+            predictions[train_end:test_end] = booster.predict(self.feature_matrix.get_features(
+                self.feature_list, row_offset + train_end, row_offset + test_end))
+            emit_fold(callbacks, fold, train_end, test_end - train_end, start, fit_end, time.perf_counter())
+            report_fold(trial, fold, labels[train_end:test_end], predictions[train_end:test_end], running_error)
+        return predictions
+
+    def get_train_params(self, model_ref, hypers: dict):
+        # Same parameters LGBMRegressor.fit would pass on to lgb.train
+        params = model_ref(**hypers).get_params()
+        num_boost_round = params['n_estimators']
+        params = {key: value for key, value in params.items() if key not in SKLEARN_ONLY_PARAMS and value is not None}
+        params.setdefault('objective', 'regression')
+        return {**self.dataset_params, **params}, num_boost_round
+
+    def get_train_set(self, start: int, stop: int):
+        key = (start, stop)
+        with self.lock:
+            if key in self.datasets:
+                train_set, construct_seconds = self.datasets.get(key)
+                self.reuses += 1
+                self.saved_seconds += construct_seconds
+                return train_set
+
+            construct_start = time.perf_counter()
+            train_set = lgb.Dataset(
+                self.feature_matrix.get_features(self.feature_list, start, stop),
+                self.labels[start:stop],
+                params=self.dataset_params,
+            ).construct()
+            construct_seconds = time.perf_counter() - construct_start
+            self.construct_seconds += construct_seconds
+            self.datasets.put(key, (train_set, construct_seconds))
+            return train_set
+
+    def clear(self):
+        self.datasets.clear()
+        self.construct_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.reuses = 0
+        self.fallbacks = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'datasets': len(self.datasets),
+            'reuses': self.reuses,
+            'fallbacks': self.fallbacks,
+            'construct_seconds': round(self.construct_seconds, 3),
+            'saved_seconds': round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,50 @@
+import os
+import time
+from collections import OrderedDict
+
+
+class LRUDict:
+
+    """ Mapping that keeps at most max_size items in memory, evicting the least recently used first. get and put
+    count as use. Used by the in-memory caches (EvalCache, FoldStore, FeatureBuilder, LGBMDatasetCache). """
+
+    def __init__(self, max_size: int):
+        assert max_size >= 0
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+
+def prune_files(directory: str, extensions: tuple, keep_days: float) -> int:
+
+    """ Removes files with one of extensions in directory, not written or read (for caches that touch files on
+    read) for keep_days, returns how many """
+
+    cutoff = time.time() - keep_days * 24 * 60 * 60
+    n_removed = 0
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if file_name.endswith(extensions) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            n_removed += 1
+    return n_removed
@@ -1,19 +1,47 @@
+import time
+
+import pandas as pd
+
+from ml_tools.checkpoint import PipelineCheckpoint
+from ml_tools.instrumentation import emit
+
+
 class ModelAssumptionSelector:
 
     """ Select of best assumptions for an ML model. Idea is to have an interface that is agnostic to
     what evaluation function you'd want to use (cross-val, validation set), and in what order you would
     like to search within each concept. (While some suggest it's best to search simultaneously in the full
     hyperparam space (space of assumptions), there might be advantages to exploring concepts sequentially,
-    since the search space becomes more manageable and the optimizers can focus on one concept at a time.) """
+    since the search space becomes more manageable and the optimizers can focus on one concept at a time.)
+    With checkpoint_dir, completed stages and progress within stages are saved there, and a rerun with the same
+    inputs resumes at the first unfinished stage (see ml_tools.checkpoint).
+    With time_budget (seconds), each stage gets a deadline: its share of the budget still left when it starts,
+    so time a stage doesn't use rolls over to later stages. Shares are equal unless budget_shares are given
+    (relative weights per selector). Selectors stop cleanly at their deadline, between evaluations (FeatureSelector
+    with n_jobs != 1 between iterations, as the candidates of one iteration are scored concurrently, FeatureRanker
+    between folds), and return their best result so far. A running evaluation is not interrupted. Budget and time
+    used per stage are reported in budget_df. """
 
     def __init__(
             self,
             selectors: tuple,  # E.g: (TrainStartSelector(...), FeatureSelector(...), Tuner(...))
             verbosity: int = 1,
+            cache=None,  # Optional EvalCache shared by all selectors that don't have their own
+            callbacks: list = None,  # Optional callables receiving events, see ml_tools.instrumentation
+            checkpoint_dir: str = None,  # Optional local directory to checkpoint stages to and resume from
+            time_budget: float = None,  # Optional total wall-clock seconds for all stages
+            budget_shares: tuple = None,  # Optional relative share of budget per selector, e.g. (1, 2, 4)
     ):
 
         self.selectors = selectors
         self.verbosity = verbosity
+        self.cache = cache
+        self.callbacks = callbacks
+        self.checkpoint_dir = checkpoint_dir
+        assert budget_shares is None or len(budget_shares) == len(selectors), 'Need one budget share per selector'
+        self.time_budget = time_budget
+        self.budget_shares = budget_shares if budget_shares is not None else (1,) * len(selectors)
+        self.budget_df = None
 
     def run(
             self,
@@ -21,10 +49,66 @@ class ModelAssumptionSelector:
             **kwargs
     ):
 
+        checkpoint = None
+        completed_stages = []
+        if self.checkpoint_dir is not None:
+            checkpoint = PipelineCheckpoint(self.checkpoint_dir, self.verbosity)
+            completed_stages = list(checkpoint.load(eval_func, kwargs, self.selectors))
+
+        pipeline_deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        budget_rows = []
         best_assumptions = {}
-        for selector in self.selectors:
-            search_result = selector.run(eval_func, **kwargs)
-            best_assumptions[selector.__class__.__name__] = search_result
+        for stage_index, selector in enumerate(self.selectors):
+            stage = selector.__class__.__name__
+            stage_budget = None
+            start = time.perf_counter()
+            if stage_index < len(completed_stages):
+                # Replaying update_kwargs on the saved result gives the same kwargs as the original run
+                search_result = completed_stages[stage_index]['search_result']
+                if self.verbosity >= 1:
+                    print(f"Resuming from checkpoint: {stage} result {search_result}")
+            else:
+                # Shared cache, callbacks and checkpoint storage are for this run only, the selector may be reused
+                original_attributes = self.prepare_selector(selector)
+                if checkpoint is not None:
+                    original_attributes.update(checkpoint.prepare_selector(stage_index, selector))
+                if pipeline_deadline is not None:
+                    stage_budget = self.get_stage_budget(stage_index, pipeline_deadline - time.monotonic())
+                    selector.deadline = time.monotonic() + stage_budget
+                emit(self.callbacks, 'stage_start', stage=stage, stage_index=stage_index, time=start)
+                try:
+                    search_result = selector.run(eval_func, **kwargs)
+                finally:
+                    selector.deadline = None
+                    for name, value in original_attributes.items():
+                        setattr(selector, name, value)
+                emit(self.callbacks, 'stage_end', stage=stage, stage_index=stage_index, time=start,
+                     duration=time.perf_counter() - start, result=search_result)
+            budget_rows.append({'stage': stage, 'budget': stage_budget, 'used': time.perf_counter() - start})
+            best_assumptions[stage] = search_result
             selector.update_kwargs(kwargs, search_result, self.verbosity)
+            if checkpoint is not None and stage_index >= len(completed_stages):
+                checkpoint.save_stage(stage, search_result, kwargs)
+
+        self.budget_df = pd.DataFrame(budget_rows).set_index('stage')
+        if self.time_budget is not None:
+            self.budget_df['share_of_total'] = self.budget_df['used'] / self.time_budget
+            if self.verbosity >= 1:
+                print(f"ModelAssumptionSelector - Time used per stage:\n{self.budget_df}")
+        if self.verbosity >= 1 and self.cache is not None:
+            print(f"ModelAssumptionSelector - Evaluation cache: {self.cache.stats}")
 
         return best_assumptions
+
+    def prepare_selector(self, selector) -> dict:
+        # Sets the shared cache and callbacks on a selector without its own, returns the original attributes
+        original_attributes = {}
+        for name, value in [('cache', self.cache), ('callbacks', self.callbacks)]:
+            if value is not None and getattr(selector, name, None) is None:
+                original_attributes[name] = getattr(selector, name, None)
+                setattr(selector, name, value)
+        return original_attributes
+
+    def get_stage_budget(self, stage_index: int, budget_left: float) -> float:
+        remaining_shares = self.budget_shares[stage_index:]
+        return max(budget_left, 0) * remaining_shares[0] / sum(remaining_shares)
@@ -0,0 +1,149 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+
+class Param(ABC):
+
+    """ Base for one hyperparameter of a search space. With condition, e.g. {'boosting_type': 'dart'} or
+    {'boosting_type': ['dart', 'goss']}, the parameter is only suggested when the (earlier) parent parameters
+    got one of those values. """
+
+    def __init__(self, name: str, condition: dict = None):
+        self.name = name
+        self.condition = condition or {}
+
+    def is_active(self, hypers: dict) -> bool:
+        for parent, allowed in self.condition.items():
+            allowed = allowed if isinstance(allowed, (list, tuple, set)) else [allowed]
+            if parent not in hypers or hypers[parent] not in allowed:
+                return False
+        return True
+
+    def validate(self):
+        assert isinstance(self.name, str) and self.name, f"Invalid parameter name {self.name!r}"
+
+    @abstractmethod
+    def suggest(self, trial):
+        pass
+
+    def __repr__(self):
+        attributes = ', '.join(f"{k}={v!r}" for k, v in vars(self).items()
+                               if v is not None and v is not False and v != {})
+        return f"{self.__class__.__name__}({attributes})"
+
+
+class FloatParam(Param):
+
+    def __init__(self, name: str, low: float, high: float, log: bool = False, step: float = None,
+                 condition: dict = None):
+        super().__init__(name, condition)
+        self.low = low
+        self.high = high
+        self.log = log
+        self.step = step
+
+    def validate(self):
+        super().validate()
+        assert self.low <= self.high, f"{self.name}: low must be <= high"
+        assert not (self.log and self.low <= 0), f"{self.name}: log scale needs low > 0"
+        assert not (self.log and self.step is not None), f"{self.name}: log scale can't have step"
+
+    def suggest(self, trial):
+        return trial.suggest_float(self.name, self.low, self.high, log=self.log, step=self.step)
+
+
+class IntParam(Param):
+
+    def __init__(self, name: str, low: int, high: int, log: bool = False, step: int = 1, condition: dict = None):
+        super().__init__(name, condition)
+        self.low = low
+        self.high = high
+        self.log = log
+        self.step = step
+
+    def validate(self):
+        super().validate()
+        assert self.low <= self.high, f"{self.name}: low must be <= high"
+        assert not (self.log and self.low <= 0), f"{self.name}: log scale needs low > 0"
+        assert not (self.log and self.step != 1), f"{self.name}: log scale needs step 1"
+
+    def suggest(self, trial):
+        return trial.suggest_int(self.name, self.low, self.high, step=self.step, log=self.log)
+
+
+class CategoricalParam(Param):
+
+    def __init__(self, name: str, choices: list, condition: dict = None):
+        super().__init__(name, condition)
+        self.choices = list(choices)
+
+    def validate(self):
+        super().validate()
+        assert len(self.choices) > 0, f"{self.name}: needs at least one choice"
+
+    def suggest(self, trial):
+        return trial.suggest_categorical(self.name, self.choices)
+
+
+# Legacy lazy_optuna_space method names, mapped to parameter type, extra keyword arguments and names of positional
+# arguments after low and high
+LEGACY_METHODS = {
+    'trial.suggest_float': (FloatParam, {}, ()),
+    'trial.suggest_uniform': (FloatParam, {}, ()),
+    'trial.suggest_loguniform': (FloatParam, {'log': True}, ()),
+    'trial.suggest_discrete_uniform': (FloatParam, {}, ('step',)),
+    'trial.suggest_int': (IntParam, {}, ()),
+    'trial.suggest_categorical': (CategoricalParam, {}, ()),
+}
+
+
+class SearchSpace:
+
+    """ Hyperparameter search space, validated and compiled once into a list of parameters that call
+    trial.suggest_* directly. Accepts Param instances and the tuple format of Tuner's lazy_optuna_space:
+    ('learning_rate', 'trial.suggest_float', 0.03, 0.3), optionally with a dict of extra arguments like
+    ('learning_rate', 'trial.suggest_float', 0.01, 0.3, {'log': True}), or for categorical parameters
+    ('boosting_type', 'trial.suggest_categorical', ['gbdt', 'dart']), see LEGACY_METHODS for the method names
+    (e.g. ('subsample', 'trial.suggest_discrete_uniform', 0.5, 1.0, 0.1) with step 0.1). Other strings that the
+    former eval based Tuner would have evaluated are not accepted. Parameters with a condition must come after
+    the parameters they depend on. """
+
+    def __init__(self, space: List):
+        self.params = [self.compile_param(param) for param in space]
+
+        names = set()
+        for param in self.params:
+            param.validate()
+            assert param.name not in names, f"Duplicate parameter {param.name}"
+            for parent in param.condition:
+                assert parent in names, f"{param.name}: condition on {parent}, which must be defined before it"
+            names.add(param.name)
+
+    @staticmethod
+    def compile_param(param) -> Param:
+        if isinstance(param, Param):
+            return param
+        assert isinstance(param, (tuple, list)) and len(param) >= 3, f"Can't parse search space entry {param!r}"
+        name, method = param[0], param[1]
+        assert method in LEGACY_METHODS, f"{name}: unknown method {method}, use one of {list(LEGACY_METHODS)}"
+        param_class, extra_kwargs, positional_names = LEGACY_METHODS[method]
+        if param_class is CategoricalParam:
+            return CategoricalParam(name, param[2], **(param[3] if len(param) > 3 else {}))
+        n_positional = 4 + len(positional_names)
+        assert len(param) >= n_positional, f"{name}: {method} needs {', '.join(('low', 'high') + positional_names)}"
+        extra_kwargs = {**extra_kwargs, **dict(zip(positional_names, param[4:n_positional]))}
+        return param_class(name, param[2], param[3],
+                           **{**extra_kwargs, **(param[n_positional] if len(param) > n_positional else {})})
+
+    def suggest(self, trial) -> dict:
+        hypers = {}
+        for param in self.params:
+            if param.is_active(hypers):
+                hypers[param.name] = param.suggest(trial)
+        return hypers
+
+    def __len__(self):
+        return len(self.params)
+
+    def __repr__(self):
+        return f"SearchSpace({self.params!r})"
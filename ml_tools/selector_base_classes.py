@@ -1,12 +1,54 @@
-class TrainStartSelectorBase:
+import inspect
+import time
+
+from ml_tools.instrumentation import describe_candidate, emit
+
+
+class SelectorBase:
+    cache = None  # Optional EvalCache (see ml_tools.eval_cache), can be shared between selectors
+    callbacks = None  # Optional list of callables receiving events, e.g. EventRecorder (ml_tools.instrumentation)
+    deadline = None  # Optional time.monotonic() by which to stop and return best result so far
+
+    def time_left(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def budget_exhausted(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def evaluate(self, eval_func, kwargs):
+        kwargs = self.forward_callbacks(eval_func, kwargs)
+        start = time.perf_counter()
+        if self.cache is None:
+            score, cached = eval_func(**kwargs), False
+        else:
+            hits = self.cache.hits
+            score = self.cache.evaluate(eval_func, kwargs)
+            cached = self.cache.hits > hits
+        self.emit_evaluation(kwargs, score, start, time.perf_counter() - start, cached)
+        return score
+
+    def emit_evaluation(self, kwargs, score, start, duration, cached=False):
+        emit(self.callbacks, 'candidate_evaluated', stage=self.__class__.__name__, time=start, duration=duration,
+             score=score, cached=cached, **describe_candidate(kwargs))
+
+    def forward_callbacks(self, eval_func, kwargs):
+        # Let eval_func emit fold level events too, if it takes callbacks and they are not already set
+        if self.callbacks and kwargs.get('callbacks') is None and \
+                'callbacks' in inspect.signature(eval_func).parameters:
+            return {**kwargs, 'callbacks': self.callbacks}
+        return kwargs
+
+
+class TrainStartSelectorBase(SelectorBase):
     @staticmethod
     def update_kwargs(kwargs, search_result, verbosity):
-        kwargs['df'] = kwargs['df'].loc[kwargs['df'].index >= search_result]
+        # Positional slice on the sorted index, a view rather than a boolean masked copy of the data
+        kwargs['df'] = kwargs['df'].iloc[kwargs['df'].index.searchsorted(search_result, side='left'):]
         if verbosity >= 1:
             print(f"Updated df to selected train start: {search_result}")
 
 
-class FeatureSelectorBase:
+class FeatureSelectorBase(SelectorBase):
     @staticmethod
     def update_kwargs(kwargs, search_result, verbosity):
         kwargs['feature_list'] = search_result
@@ -14,7 +56,7 @@ class FeatureSelectorBase:
             print(f"Updated feature_list to selected: {search_result}")
 
 
-class TunerBase:
+class TunerBase(SelectorBase):
     @staticmethod
     def update_kwargs(kwargs, search_result, verbosity):
         kwargs['hypers'] = search_result
@@ -0,0 +1,77 @@
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+@functools.lru_cache(maxsize=None)
+def import_optuna():
+
+    """ Optuna, imported at first use rather than with the selectors, since it takes long to import and is only
+    needed for Optuna searches. Its logging is set to warnings once, at that first import. """
+
+    import optuna
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    return optuna
+
+
+def get_storage(storage: str):
+
+    """ Local SQLite file backed Optuna storage, so several processes can share a study without a database
+    server. Storage URLs (e.g. 'sqlite:///study.db') are passed through as is. """
+
+    if storage is None or '://' in storage:
+        return storage
+    return f"sqlite:///{os.path.abspath(storage)}"
+
+
+def create_or_load_study(
+        direction: str,
+        storage: str = None,
+        study_name: str = None,
+        pruner=None,
+        inputs_fingerprint: str = None,  # See eval_cache.get_inputs_fingerprint, to only resume on the same inputs
+):
+    # With storage the study is resumed if it already exists, e.g. after interruption or from a worker process.
+    # The name includes the inputs fingerprint, so a rerun on new data starts a new study next to the old one.
+    if storage is not None and inputs_fingerprint is not None:
+        study_name = f"{study_name}_{inputs_fingerprint[:12]}"
+    study = import_optuna().create_study(
+        direction=direction,
+        storage=get_storage(storage),
+        study_name=study_name,
+        pruner=pruner,
+        load_if_exists=storage is not None,
+    )
+    if inputs_fingerprint is not None:
+        study.set_user_attr('inputs_fingerprint', inputs_fingerprint)
+    return study
+
+
+def count_finished_trials(study) -> int:
+    # Trials still marked running were interrupted, so they are run again
+    return sum(trial.state.is_finished() for trial in study.trials)
+
+
+def optimize_in_workers(
+        selector,  # Selector with create_study() and optimize(study, eval_func, kwargs, n_trials) methods
+        eval_func,
+        kwargs: dict,
+        n_trials: int,
+        n_workers: int,
+):
+
+    """ Spread n_trials over n_workers processes that share the selector's study through its storage.
+    The selector, eval_func and kwargs must be picklable. """
+
+    assert selector.storage is not None, 'Parallel workers need storage to share the study'
+    shares = [n_trials // n_workers + (i < n_trials % n_workers) for i in range(n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(optimize_worker, selector, eval_func, kwargs, share)
+                   for share in shares if share > 0]
+        for future in futures:
+            future.result()
+
+
+def optimize_worker(selector, eval_func, kwargs, n_trials):
+    # Module level so it can be pickled to worker processes
+    selector.optimize(selector.create_study(), eval_func, kwargs, n_trials)
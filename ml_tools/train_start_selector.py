@@ -1,6 +1,8 @@
-import optuna
+import numpy as np
+import pandas as pd
+from ml_tools.eval_cache import get_inputs_fingerprint
 from ml_tools.selector_base_classes import TrainStartSelectorBase
-optuna.logging.set_verbosity(optuna.logging.WARNING)
+from ml_tools.study_storage import count_finished_trials, create_or_load_study, import_optuna, optimize_in_workers
 
 
 class TrainStartSelector(TrainStartSelectorBase):
@@ -8,21 +10,53 @@ class TrainStartSelector(TrainStartSelectorBase):
     """ To select where good signal starts in the data, since old data might not be so relevant any more.
     This can be relevand not only for time series forecasting and regression, but also classification cases
     where old data might no longer be very valid. Suggested to explore with reasonable cross-validation window.
-    Assumes input dataframe is sorted so older data appears on top. """
+    Assumes input dataframe is sorted so older data appears on top.
+    Candidate starts are the first row of each timestamp, or of each period if granularity is set (e.g. 'D' or
+    'W'), which also makes near-identical starts the same candidate. Each candidate is scored at most once.
+    With search='optuna' a TPE study picks among candidates for n_trials, with search='grid' the candidates are
+    searched coarse-to-fine: grid_size evenly spaced starts, then refine_rounds zooms in around the best one,
+    which suits this 1-D problem with far fewer evaluations.
+    For search='optuna', storage and n_workers work as for Tuner: resumable study in a local file, shared by
+    n_workers processes. A study is only resumed for the same data and candidate settings, since its trials
+    refer to candidates by position. """
 
     def __init__(
             self,
             eval_window_rows: int,  # Exclude eval window from slicing for min_train_rows
             min_train_rows: int = 1000,
             direction: str = 'minimize',
-            n_trials: int = 30
+            n_trials: int = 30,
+            cache=None,  # Optional EvalCache to skip train starts already scored
+            callbacks: list = None,  # Optional callables receiving events, see ml_tools.instrumentation
+            search: str = 'optuna',  # 'optuna' or 'grid' (coarse-to-fine)
+            granularity: str = None,  # Optional pandas period to snap candidate starts to, e.g. 'D' or 'W'
+            grid_size: int = 8,  # Starts scored per round when search='grid'
+            refine_rounds: int = 2,  # Zoom-in rounds around best start after coarse grid when search='grid'
+            n_workers: int = 1,  # Number of processes to run trials in when search='optuna', needs storage if > 1
+            storage: str = None,  # Optional path to SQLite file to keep the study in
+            study_name: str = 'train_start',  # Name of study in storage, rerun with same name resumes it
     ):
         assert direction in ['minimize', 'maximize']
+        assert search in ['optuna', 'grid']
+        assert grid_size >= 2
         self.min_train_rows = min_train_rows
         self.eval_window_rows = eval_window_rows
         self.direction = direction
         self.n_trials = n_trials
+        self.cache = cache
+        self.callbacks = callbacks
+        self.search = search
+        self.granularity = granularity
+        self.grid_size = grid_size
+        self.refine_rounds = refine_rounds
+        self.n_workers = n_workers
+        self.storage = storage
+        self.study_name = study_name
+        self.inputs_fingerprint = None
         self.original_df = None
+        self.candidates = None
+        self.scores = None
+        self.result_df = None
 
     def run(
             self,
@@ -30,21 +64,101 @@ class TrainStartSelector(TrainStartSelectorBase):
             **kwargs,  # Set all arguments to eval_func when falling
     ):
         assert 'df' in kwargs.keys(), 'df must be in kwargs'
-        self.original_df = kwargs['df'].copy()
+
+        # Only read from, slices below are positional so no copy of the data is needed
+        self.original_df = kwargs['df']
+        self.scores = {}
+        max_iloc = len(self.original_df) - self.eval_window_rows - self.min_train_rows  # Max iloc matching
+        assert max_iloc >= 0, 'Not enough rows for eval_window_rows and min_train_rows'
+        self.candidates = self.get_candidate_starts(self.original_df.index, max_iloc)
+
+        if self.search == 'grid':
+            self.run_grid_search(eval_func, kwargs)
+        else:
+            self.run_optuna_search(eval_func, kwargs)
+
+        if not self.scores:
+            # E.g. no time budget left, fall back to using all data
+            self.score_start(eval_func, kwargs, int(self.candidates[0]))
+
+        self.result_df = pd.DataFrame({
+            'iloc_start': list(self.scores.keys()),
+            'train_start': self.original_df.index[list(self.scores.keys())],
+            'score': list(self.scores.values()),
+        }).sort_values('iloc_start').set_index('iloc_start')
+
+        best_iloc_start = self.get_best_iloc_start()
+        best_train_start_idx = self.original_df.index[best_iloc_start]
+
+        return best_train_start_idx
+
+    def get_candidate_starts(self, index: pd.Index, max_iloc: int) -> np.ndarray:
+        # First row of each timestamp (or period), so a candidate never starts in the middle of one
+        keys = index[:max_iloc + 1]
+        keys = keys.to_period(self.granularity).asi8 if self.granularity is not None else np.asarray(keys)
+        return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    def score_start(self, eval_func, kwargs, iloc_start: int) -> float:
+        if iloc_start not in self.scores:
+            kwargs['df'] = self.original_df.iloc[iloc_start:]
+            self.scores[iloc_start] = self.evaluate(eval_func, kwargs)
+        return self.scores[iloc_start]
+
+    def get_best_iloc_start(self) -> int:
+        # Ties go to earliest start, i.e. more training data
+        sign = 1 if self.direction == 'minimize' else -1
+        return min(self.scores, key=lambda iloc_start: (sign * self.scores[iloc_start], iloc_start))
+
+    def run_optuna_search(self, eval_func, kwargs):
+        if self.storage is not None:
+            settings = (self.direction, self.eval_window_rows, self.min_train_rows, self.granularity)
+            self.inputs_fingerprint = get_inputs_fingerprint(eval_func, {**kwargs, 'df': self.original_df}, settings)
+        study = self.create_study()
+        n_remaining_trials = max(self.n_trials - count_finished_trials(study), 0)
+        if self.n_workers > 1:
+            optimize_in_workers(self, eval_func, kwargs, n_remaining_trials, self.n_workers)
+        else:
+            self.optimize(study, eval_func, kwargs, n_remaining_trials)
+
+        # Collect scores from the study, since trials may have run in other processes or earlier runs
+        complete = import_optuna().trial.TrialState.COMPLETE
+        for trial in study.trials:
+            if trial.state == complete:
+                self.scores.setdefault(int(self.candidates[trial.params['candidate']]), trial.value)
+
+    def create_study(self):
+        return create_or_load_study(
+            direction=self.direction,
+            storage=self.storage,
+            study_name=self.study_name if self.storage is not None else None,
+            inputs_fingerprint=self.inputs_fingerprint,
+        )
+
+    def optimize(self, study, eval_func, kwargs, n_trials):
 
         # Note: Tried more light-weight implementation with scipy-optimize but ran into troubles
         # (Not fully continuous loss function)
         def objective(trial):
-            iloc_start = trial.suggest_int(
-                'iloc_start',
-                0,  # Min iloc to include even oldest data
-                len(kwargs['df']) - self.eval_window_rows - self.min_train_rows,  # Max iloc matching
-            )
-            kwargs['df'] = self.original_df.iloc[int(iloc_start):]
-            return eval_func(**kwargs)
-
-        study = optuna.create_study(direction=self.direction)
-        study.optimize(objective, n_trials=self.n_trials)
-        best_train_start_idx = self.original_df.iloc[study.best_params['iloc_start']:].index.min()
+            candidate = trial.suggest_int('candidate', 0, len(self.candidates) - 1)
+            return self.score_start(eval_func, kwargs, int(self.candidates[candidate]))
 
-        return best_train_start_idx
+        # Optuna checks timeout between trials, so a running trial is finished before stopping
+        time_left = self.time_left()
+        study.optimize(objective, n_trials=n_trials, timeout=None if time_left is None else max(time_left, 0))
+
+    def run_grid_search(self, eval_func, kwargs):
+        candidates = self.candidates
+        low, high = 0, len(candidates) - 1
+        for _ in range(self.refine_rounds + 1):
+            grid = np.unique(np.linspace(low, high, self.grid_size).round().astype(int))
+            for candidate in grid:
+                if self.scores and self.budget_exhausted():
+                    return
+                self.score_start(eval_func, kwargs, int(candidates[candidate]))
+
+            # Zoom in on the grid cells on each side of best start so far
+            best_candidate = int(np.searchsorted(candidates, self.get_best_iloc_start()))
+            step = int(np.ceil((high - low) / (self.grid_size - 1)))
+            low, high = max(best_candidate - step, 0), min(best_candidate + step, len(candidates) - 1)
+            if high - low < 2:
+                break
@@ -1,5 +1,8 @@
-import optuna
+import inspect
+from ml_tools.eval_cache import get_inputs_fingerprint
+from ml_tools.search_space import SearchSpace
 from ml_tools.selector_base_classes import TunerBase
+from ml_tools.study_storage import count_finished_trials, create_or_load_study, import_optuna, optimize_in_workers
 from typing import List
 
 
@@ -11,19 +14,45 @@ class Tuner(TunerBase):
         ('learning_rate', 'trial.suggest_float', 0.03, 0.3),
         ('n_estimators', 'trial.suggest_int', 10, 200)
     ]
+    The space is validated and compiled once into direct trial.suggest_* calls. Besides these tuples it can hold
+    FloatParam, IntParam and CategoricalParam from ml_tools.search_space, for log scales, steps, categorical
+    choices and parameters conditional on others, or be a SearchSpace.
+    With a pruner ('median', 'successive_halving' or an optuna pruner instance), the trial is passed to eval_func
+    as trial (if it takes one, like get_mae_from_cv_time_series), which reports the running score after every
+    fold so hopeless trials stop after the first few folds. Pruned trials are marked as such in result_df.
+    With storage (an SQLite file path, see ml_tools.study_storage) the study is kept on disk: a rerun on the same
+    inputs (data, eval kwargs and search space) resumes it and only runs the trials still missing of n_trials,
+    a rerun on other inputs starts a new study in the same file. With n_workers > 1 the trials are spread over
+    that many processes sharing the study (eval_func and kwargs must then be picklable).
     """
 
     def __init__(
             self,
-            lazy_optuna_space: List,
+            lazy_optuna_space: List,  # Or SearchSpace
             direction: str = 'minimize',
             n_trials: int = 40,
-            verbosity: int = 1
+            verbosity: int = 1,
+            cache=None,  # Optional EvalCache to skip hyperparameters already scored
+            callbacks: list = None,  # Optional callables receiving events, see ml_tools.instrumentation
+            pruner=None,  # Optional 'median', 'successive_halving' or optuna.pruners.BasePruner instance
+            n_workers: int = 1,  # Number of processes to run trials in, needs storage if > 1
+            storage: str = None,  # Optional path to SQLite file to keep the study in
+            study_name: str = 'tuner',  # Name of study in storage, rerun with same name resumes it
     ):
         self.direction = direction
         self.lazy_optuna_space = lazy_optuna_space
+        self.search_space = (lazy_optuna_space if isinstance(lazy_optuna_space, SearchSpace)
+                             else SearchSpace(lazy_optuna_space))
         self.n_trials = n_trials
         self.verbosity = verbosity
+        self.cache = cache
+        self.callbacks = callbacks
+        self.pruner = pruner
+        self.n_workers = n_workers
+        self.storage = storage
+        self.study_name = study_name
+        self.inputs_fingerprint = None
+        self.result_df = None
 
     def run(
             self,
@@ -33,38 +62,81 @@ class Tuner(TunerBase):
 
         # Get baseline score with out-of-box hyperparameters of model
         kwargs['hypers'] = {}
-        baseline_score = eval_func(**kwargs)
+        baseline_score = self.evaluate(eval_func, kwargs)
 
         if self.verbosity >= 1:
             print(f"Baseline score with out-of-box hyperparamers {baseline_score :.2f}")
 
-        def objective(trial):
+        if self.storage is not None:
+            self.inputs_fingerprint = get_inputs_fingerprint(eval_func, kwargs, (self.direction, self.search_space))
+        study = self.create_study()
+        n_remaining_trials = max(self.n_trials - count_finished_trials(study), 0)
+        if self.n_workers > 1:
+            optimize_in_workers(self, eval_func, kwargs, n_remaining_trials, self.n_workers)
+        else:
+            self.optimize(study, eval_func, kwargs, n_remaining_trials)
+
+        self.result_df = study.trials_dataframe(attrs=('number', 'value', 'params', 'state')).set_index('number')
+        if self.verbosity >= 1 and self.pruner is not None:
+            n_pruned = (self.result_df['state'] == 'PRUNED').sum()
+            print(f"Pruned {n_pruned} of {len(self.result_df)} trials")
 
-            def parse_optuna_space(trial):
+        best_params = self.compare_to_baseline(baseline_score, study)
 
-                def suggest_from_row(x: tuple, trial):  # noqa
-                    return list(eval('{'f"""'{x[0]}': {x[1]}('{x[0]}', {x[2]}, {x[3]})"""'}').values())[0]
+        return best_params
 
-                hyper_space = {}
-                for i in range(len(self.lazy_optuna_space)):
-                    hyper_space[self.lazy_optuna_space[i][0]] = suggest_from_row(self.lazy_optuna_space[i], trial)
+    def create_study(self):
+        return create_or_load_study(
+            direction=self.direction,
+            storage=self.storage,
+            study_name=self.study_name if self.storage is not None else None,
+            pruner=self.get_pruner(),
+            inputs_fingerprint=self.inputs_fingerprint,
+        )
 
-                return hyper_space
+    def optimize(self, study, eval_func, kwargs, n_trials):
+        optuna = import_optuna()
 
-            kwargs['hypers'] = parse_optuna_space(trial)
-            score = eval_func(**kwargs)
+        def objective(trial):
+            kwargs['hypers'] = self.search_space.suggest(trial)
+            try:
+                score = self.evaluate(eval_func, self.get_trial_kwargs(eval_func, kwargs, trial))
+            except optuna.TrialPruned:
+                if self.verbosity >= 1:
+                    print(f"""Trial {trial.number}, pruned with hypers {kwargs['hypers']}""")
+                raise
             if self.verbosity >= 1:
                 print(f"""Trial {trial.number}, got result {score :.2f} with hypers {kwargs['hypers']}""")
             return score
-            
-        study = optuna.create_study(direction=self.direction)
-        study.optimize(objective, n_trials=self.n_trials)
 
-        best_params = self.compare_to_baseline(baseline_score, study)
-
-        return best_params
+        # Optuna checks timeout between trials, so a running trial is finished before stopping
+        time_left = self.time_left()
+        study.optimize(objective, n_trials=n_trials, timeout=None if time_left is None else max(time_left, 0))
+
+    def get_pruner(self):
+        optuna = import_optuna()
+        if self.pruner is None:
+            return optuna.pruners.NopPruner()
+        if self.pruner == 'median':
+            # Let some trials and folds complete first, so there is something to compare with
+            return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=2)
+        if self.pruner == 'successive_halving':
+            return optuna.pruners.SuccessiveHalvingPruner()
+        assert isinstance(self.pruner, optuna.pruners.BasePruner), f"Unknown pruner {self.pruner}"
+        return self.pruner
+
+    def get_trial_kwargs(self, eval_func, kwargs, trial):
+        # Only hand the trial to eval_func when pruning, so it can report fold scores
+        if self.pruner is not None and 'trial' in inspect.signature(eval_func).parameters:
+            return {**kwargs, 'trial': trial}
+        return kwargs
 
     def compare_to_baseline(self, baseline_score, study):
+        optuna = import_optuna()
+        if not any(trial.state == optuna.trial.TrialState.COMPLETE for trial in study.trials):
+            if self.verbosity >= 1:
+                print("No completed tuning trials, using out-of-box hyperparameters")
+            return {}
         if baseline_score <= study.best_value:
             if self.direction == 'minimize':
                 best_params = {}
@@ -1,5 +1,13 @@
 from setuptools import setup, find_packages
 
+# Core install is numpy and pandas only, heavier dependencies are imported at first use and installed as extras,
+# e.g. pip install ml-tools[tuning,lightgbm] or ml-tools[all]
+TUNING_REQUIRES = ['optuna==2.10.0']
+LIGHTGBM_REQUIRES = ['lightgbm==3.3.2']
+PLOT_REQUIRES = ['matplotlib==3.5.1', 'seaborn==0.11.2', 'plotly==5.4.0', 'cufflinks==0.17.3', 'chart-studio==1.1.0']
+NOTEBOOK_REQUIRES = ['jupyter==1.0.0', 'ipython==7.31.0', 'shap-hypetune==0.1.1', 'catboost==1.0.4']
+PARQUET_REQUIRES = ['pyarrow==7.0.0']
+
 setup(
     name='ml-tools',
     version='0.0.1',
@@ -10,24 +18,17 @@ setup(
     license='None',
     packages=find_packages(exclude=['contrib', 'docs', 'tests', 'examples']),
     install_requires=[
-        "jupyter==1.0.0",
         "numpy==1.21",
         "pandas==1.4.1",
-        "shap-hypetune==0.1.1",
-        "ipython==7.31.0",
-        "lightgbm==3.3.2",
-        "catboost==1.0.4",
-        "cufflinks==0.17.3",
-        "seaborn==0.11.2",
-        "matplotlib==3.5.1",
-        "plotly==5.4.0",
-        "chart-studio==1.1.0",
-        "optuna==2.10.0"
     ],
     extras_require={
-        'test': [
-            'pytest==6.2.5'
-        ],
+        'tuning': TUNING_REQUIRES,
+        'lightgbm': LIGHTGBM_REQUIRES,
+        'plot': PLOT_REQUIRES,
+        'notebook': NOTEBOOK_REQUIRES,
+        'parquet': PARQUET_REQUIRES,
+        'all': TUNING_REQUIRES + LIGHTGBM_REQUIRES + PLOT_REQUIRES + NOTEBOOK_REQUIRES + PARQUET_REQUIRES,
+        'test': ['pytest==6.2.5'] + TUNING_REQUIRES + LIGHTGBM_REQUIRES,
     },
     tests_require=['nose'],
     zip_safe=False
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from ml_tools.datasets import generate_synthetic_data
+
+
+class LeastSquares:
+    # Cheap deterministic model for tests
+    def fit(self, X, y):
+        X = np.column_stack([np.asarray(X, dtype=float), np.ones(len(X))])
+        self.coef = np.linalg.lstsq(X, np.asarray(y, dtype=float), rcond=None)[0]
+        return self
+
+    def predict(self, X):
+        return np.column_stack([np.asarray(X, dtype=float), np.ones(len(X))]) @ self.coef
+
+
+def get_synthetic_df(freq='d'):
+    df = generate_synthetic_data(freq=freq, weekday_offset=True, yearly_offset=True)
+    df['dow'] = df.index.weekday
+    df['doy'] = df.index.dayofyear
+    return df
+
+
+@pytest.fixture
+def least_squares():
+    return LeastSquares
+
+
+@pytest.fixture
+def synthetic_df():
+    # Factory, as tests need daily or hourly data and sometimes several frames
+    return get_synthetic_df
@@ -0,0 +1,59 @@
+import pytest
+from lightgbm import LGBMRegressor
+
+from ml_tools.eval import get_mae_from_cv_time_series
+from ml_tools.feature_selector import FeatureSelector
+from ml_tools.model_assumption_selector import ModelAssumptionSelector
+from ml_tools.selector_base_classes import TunerBase
+
+eval_calls = []
+
+
+def counted_mae(df, model_ref, feature_list=None):
+    eval_calls.append(feature_list)
+    return get_mae_from_cv_time_series(df=df, model_ref=model_ref, feature_list=feature_list)
+
+
+class PreemptedOnceSelector(TunerBase):
+    failures = ['preempted']  # Class attribute, so not part of the selector settings in the checkpoint
+
+    def run(self, eval_func, **kwargs):
+        if self.failures:
+            raise RuntimeError(self.failures.pop())
+        return {}
+
+
+def test_rerun_resumes_at_first_unfinished_stage(tmp_path, synthetic_df):
+    df = synthetic_df()
+
+    def run_pipeline():
+        mas = ModelAssumptionSelector(
+            selectors=(FeatureSelector(remind_sorting=False), PreemptedOnceSelector()),
+            checkpoint_dir=str(tmp_path),
+        )
+        return mas.run(eval_func=counted_mae, df=df, model_ref=LGBMRegressor, feature_list=['dow', 'doy'])
+
+    with pytest.raises(RuntimeError):
+        run_pipeline()
+    n_calls_first_run = len(eval_calls)
+    assert n_calls_first_run > 0
+
+    best_assumptions = run_pipeline()
+    assert len(eval_calls) == n_calls_first_run  # FeatureSelector stage was not run again
+    assert best_assumptions['PreemptedOnceSelector'] == {}
+
+
+def test_selectors_reused_with_other_checkpoint_dir(tmp_path, synthetic_df):
+    from ml_tools.tuner import Tuner
+
+    df = synthetic_df()
+    tuner = Tuner(lazy_optuna_space=[('n_estimators', 'trial.suggest_int', 10, 50)], n_trials=2, verbosity=0)
+
+    for checkpoint_dir in [tmp_path / 'a', tmp_path / 'b']:
+        mas = ModelAssumptionSelector(selectors=(tuner,), checkpoint_dir=str(checkpoint_dir), verbosity=0)
+        mas.run(eval_func=get_mae_from_cv_time_series, df=df, model_ref=LGBMRegressor, feature_list=['dow', 'doy'])
+
+        # Storage and cache of the checkpoint are only set during the stage
+        assert tuner.storage is None and tuner.cache is None
+        assert (checkpoint_dir / 'stage_0_Tuner.db').exists()
+        assert len(tuner.result_df) == 2
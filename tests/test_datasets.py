@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from ml_tools.datasets import (
+    HOUR_OFFSETS, WEEKDAY_OFFSETS, generate_synthetic_data, iter_synthetic_data_chunks, write_synthetic_memmap
+)
+
+
+def test_generate_synthetic_data_matches_offset_lookups():
+    df = generate_synthetic_data(hour_offset=True, weekday_offset=True, yearly_offset=True)
+
+    expected = np.linspace(100, 400, len(df))
+    expected = expected * (np.sin(2 * np.pi * df.index.dayofyear / 366) * 0.2 + 1)
+    expected = expected * HOUR_OFFSETS[df.index.hour] * WEEKDAY_OFFSETS[df.index.weekday]
+
+    assert df.index.freq == pd.tseries.frequencies.to_offset('h')
+    np.testing.assert_allclose(df['label'].to_numpy(), expected)
+
+
+def test_generate_synthetic_panel():
+    df = generate_synthetic_data(freq='d', n_series=3, seed=1, dtype='float32')
+    single = generate_synthetic_data(freq='d')
+
+    assert len(df) == 3 * len(single)
+    assert df.index.is_monotonic_increasing
+    assert df['label'].dtype == np.float32
+    assert set(df['series_id']) == {0, 1, 2}
+    assert df.equals(generate_synthetic_data(freq='d', n_series=3, seed=1, dtype='float32'))
+
+
+def test_synthetic_chunks_line_up_with_full_dataset(tmp_path):
+    kwargs = dict(hour_offset=True, weekday_offset=True, yearly_offset=True, n_series=2, seed=0)
+    full = generate_synthetic_data(**kwargs)
+    chunks = list(iter_synthetic_data_chunks(chunk_rows=1000, **kwargs))
+
+    assert len(chunks) == int(np.ceil(len(full) / 2 / 1000))
+    pd.testing.assert_frame_equal(pd.concat(chunks), full, check_freq=False)
+
+    memmap = write_synthetic_memmap(str(tmp_path / 'synthetic.dat'), chunk_rows=1000, **kwargs)
+    np.testing.assert_array_equal(memmap['label'], full['label'].to_numpy())
+    np.testing.assert_array_equal(memmap['timestamp'], full.index.asi8)
@@ -0,0 +1,179 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+from ml_tools.datasets import generate_synthetic_data
+from ml_tools.eval import CVResult, FeatureMatrix, FoldPlan, cv_time_series, get_mae_from_cv_time_series
+
+
+def reference_cv_time_series(df, model_ref, feature_list, cv_start, step_days):
+    # Slicing implementation that the fold engine replaced
+    df = df.copy()
+    split = cv_start
+    model = model_ref()
+    while split < df.index.date.max():
+        cv_train = df[:split]
+        cv_test = df.loc[df.index > cv_train.index.max()]
+        model.fit(cv_train[feature_list], cv_train['label'])
+        df.loc[df.index.isin(cv_test.index), 'cv_pred'] = model.predict(cv_test[feature_list])
+        split += datetime.timedelta(days=step_days)
+    return df
+
+
+def test_cv_time_series_matches_reference_slicing(least_squares, synthetic_df):
+    cv_start = datetime.date(2021, 6, 10)
+    for freq in ['d', 'h']:
+        df = synthetic_df(freq)
+        expected = reference_cv_time_series(df, least_squares, ['dow', 'doy'], cv_start, step_days=10)
+        result = cv_time_series(df, least_squares, ['dow', 'doy'], cv_start=cv_start, step_days=10)
+        np.testing.assert_allclose(result['cv_pred'].to_numpy(), expected['cv_pred'].to_numpy())
+
+
+def test_fold_plan_is_shared_and_rebuilt_on_mismatch(least_squares, synthetic_df):
+    df = synthetic_df()
+    fold_plan = FoldPlan(df.index, cv_start=datetime.date(2021, 6, 10), step_days=10)
+    assert fold_plan.matches(df.index, datetime.date(2021, 6, 10), 10)
+    assert not fold_plan.matches(df.index[10:], datetime.date(2021, 6, 10), 10)
+    shifted_index = df.index[:1].append(df.index[1:-1] + pd.Timedelta(hours=12)).append(df.index[-1:])
+    assert not fold_plan.matches(shifted_index, datetime.date(2021, 6, 10), 10)  # Same length and endpoints
+
+    score = get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], fold_plan=fold_plan)
+    assert score == get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'])
+    assert (get_mae_from_cv_time_series(df.iloc[10:], least_squares, ['dow', 'doy'], fold_plan=fold_plan) ==
+            get_mae_from_cv_time_series(df.iloc[10:], least_squares, ['dow', 'doy']))
+
+
+def test_parallel_folds_match_sequential(least_squares, synthetic_df):
+    df = synthetic_df()
+    expected = cv_time_series(df, least_squares, ['dow', 'doy'])['cv_pred']
+    result = cv_time_series(df, least_squares, ['dow', 'doy'], n_jobs=2, parallel_backend='thread')
+    np.testing.assert_array_equal(result['cv_pred'].to_numpy(), expected.to_numpy())
+
+    # Pickled fold rows can round differently in the least squares fit
+    result = cv_time_series(df, least_squares, ['dow', 'doy'], n_jobs=2, parallel_backend='process')
+    np.testing.assert_allclose(result['cv_pred'].to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+class RunningMean:
+    # Model that can continue training, predicts mean of all labels seen so far
+    def fit(self, X, y):
+        self.n, self.total = 0, 0.0
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        self.n += len(y)
+        self.total += float(np.sum(y))
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.total / self.n)
+
+
+def test_incremental_folds_only_feed_new_rows(synthetic_df):
+    df = synthetic_df()
+    full = cv_time_series(df, RunningMean, ['dow'])['cv_pred']
+    incremental = cv_time_series(df, RunningMean, ['dow'], incremental=True)['cv_pred']
+
+    # Running mean is exact when fed incrementally, so results match full refit
+    np.testing.assert_allclose(incremental.to_numpy(), full.to_numpy())
+
+
+def test_feature_matrix_matches_dataframe_path(least_squares, synthetic_df):
+    df = synthetic_df()
+    feature_matrix = FeatureMatrix(df, columns=['dow', 'doy'])
+    assert feature_matrix.values.flags['F_CONTIGUOUS']
+
+    # Adjacent columns are a view, other subsets a gather
+    assert np.shares_memory(feature_matrix.get_features(['dow', 'doy']), feature_matrix.values)
+    np.testing.assert_array_equal(feature_matrix.get_features(['doy', 'dow'], 5, 10),
+                                  df[['doy', 'dow']].to_numpy()[5:10])
+
+    # Also for row slices of df, e.g. later train starts
+    for sliced_df in [df, df.iloc[100:]]:
+        for feature_list in [['dow', 'doy'], ['doy']]:
+            assert (get_mae_from_cv_time_series(sliced_df, least_squares, feature_list,
+                                                feature_matrix=feature_matrix) ==
+                    get_mae_from_cv_time_series(sliced_df, least_squares, feature_list))
+    assert feature_matrix.row_offset(df.iloc[100:]) == 100
+    assert feature_matrix.row_offset(df.iloc[::2]) is None
+    assert feature_matrix.row_offset(df.drop(index=df.index[50])) is None  # Same first and last timestamp
+
+    # Rows of a panel can't be located by timestamp
+    panel_df = generate_synthetic_data(freq='d', n_series=2)
+    assert FeatureMatrix(panel_df, columns=['label']).row_offset(panel_df.iloc[1:]) is None
+
+    float32_matrix = FeatureMatrix(df, columns=['dow', 'doy'], dtype=np.float32)
+    assert float32_matrix.dtype == np.float32
+    assert np.isclose(get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], feature_matrix=float32_matrix),
+                      get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy']), rtol=1e-4)
+
+
+def test_cv_result_metrics_match_dataframe(least_squares, synthetic_df):
+    df = synthetic_df()
+    result = cv_time_series(df, least_squares, ['dow', 'doy'], as_frame=False)
+    assert isinstance(result, CVResult)
+    assert len(result) == len(df)
+
+    cv_df = cv_time_series(df, least_squares, ['dow', 'doy'])
+    errors = (cv_df['label'] - cv_df['cv_pred']).dropna()
+    assert np.isclose(result.mae(), errors.abs().mean())
+    assert np.isclose(result.rmse(), np.sqrt((errors ** 2).mean()))
+    assert np.isclose(result.mape(), (errors.abs() / cv_df.loc[errors.index, 'label'].abs()).mean())
+    assert np.isclose(result.pinball(0.5), result.mae() / 2)
+    assert result.mae() == get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'])
+
+    fold_metrics = result.fold_metrics()
+    assert len(fold_metrics) == len(result.folds)
+    assert fold_metrics['test_rows'].sum() == len(errors)
+
+    frame = result.to_frame()
+    assert list(frame.columns) == ['label', 'cv_pred', 'fold']
+    assert (frame['fold'] == -1).sum() == cv_df['cv_pred'].isna().sum()
+
+
+def test_panel_folds_are_shared_by_entities_at_a_timestamp(least_squares):
+    df = generate_synthetic_data(freq='d', weekday_offset=True, yearly_offset=True, n_series=3, seed=0)
+    df['dow'] = df.index.weekday
+    df['level'] = df['series_id'].map(df.groupby('series_id')['label'].mean())
+
+    result = cv_time_series(df, least_squares, ['dow', 'level'], entity_col='series_id', as_frame=False)
+    folds_per_timestamp = pd.Series(result.fold_ids, index=df.index).groupby(level=0).nunique()
+    assert (folds_per_timestamp == 1).all()
+
+    # Same boundaries as for one of the series on its own
+    series_fold_plan = FoldPlan(df.index[::3])
+    assert (result.fold_ids >= 0).sum() == 3 * (series_fold_plan.test_ends[-1] - series_fold_plan.train_ends[0])
+
+
+def test_model_per_entity_matches_separate_runs(least_squares):
+    df = generate_synthetic_data(freq='d', weekday_offset=True, yearly_offset=True, n_series=3, seed=0)
+    df['dow'] = df.index.weekday
+
+    expected = pd.concat([cv_time_series(entity_df, least_squares, ['dow'])
+                          for _, entity_df in df.groupby('series_id')])
+    for n_jobs in [1, 2]:
+        result = cv_time_series(df, least_squares, ['dow'], entity_col='series_id', model_per_entity=True,
+                                n_jobs=n_jobs)
+        for entity in range(3):
+            np.testing.assert_allclose(result.loc[result['series_id'] == entity, 'cv_pred'].to_numpy(),
+                                       expected.loc[expected['series_id'] == entity, 'cv_pred'].to_numpy())
+
+    assert np.isfinite(get_mae_from_cv_time_series(df, least_squares, ['dow'], entity_col='series_id',
+                                                   model_per_entity=True))
+
+
+def test_model_per_entity_reports_folds(least_squares):
+    import optuna
+
+    df = generate_synthetic_data(freq='d', weekday_offset=True, yearly_offset=True, n_series=3, seed=0)
+    df['dow'] = df.index.weekday
+    events = []
+    cv_time_series(df, least_squares, ['dow'], entity_col='series_id', model_per_entity=True, callbacks=[events.append])
+    assert len(events) == len(FoldPlan(df.index))
+
+    # Pruned after the first fold across all entities, as with one global model
+    study = optuna.create_study(pruner=optuna.pruners.ThresholdPruner(upper=0.0))
+    trial = study.ask()
+    with pytest.raises(optuna.TrialPruned, match='fold 0'):
+        cv_time_series(df, least_squares, ['dow'], entity_col='series_id', model_per_entity=True, trial=trial)
@@ -0,0 +1,73 @@
+from ml_tools.datasets import generate_synthetic_data
+from ml_tools.eval_cache import EvalCache
+
+calls = []
+
+
+def count_eval(df, feature_list, hypers: dict = {}):
+    calls.append(feature_list)
+    return float(len(feature_list))
+
+
+def test_eval_cache_is_order_insensitive_and_persists(tmp_path):
+
+    df = generate_synthetic_data(freq='d')
+    calls.clear()
+
+    cache = EvalCache(cache_dir=str(tmp_path))
+    cache.evaluate(count_eval, dict(df=df, feature_list=['a', 'b']))
+    cache.evaluate(count_eval, dict(df=df, feature_list=['b', 'a'], hypers={}))
+    assert len(calls) == 1
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+    # New cache instance on same directory should not need to evaluate again
+    new_cache = EvalCache(cache_dir=str(tmp_path))
+    new_cache.evaluate(count_eval, dict(df=df, feature_list=['a', 'b']))
+    assert len(calls) == 1
+
+    # Different data gives new key
+    new_cache.evaluate(count_eval, dict(df=df.iloc[1:], feature_list=['a', 'b']))
+    assert len(calls) == 2
+
+    assert new_cache.prune(keep_days=1) == 0
+    assert new_cache.prune(keep_days=-1) == 2
+
+
+def model_eval(df, feature_list, model_ref):
+    return model_ref()
+
+
+def make_eval(scale):
+    def scaled_eval(df, feature_list, hypers: dict = {}):
+        return scale * len(feature_list)
+    return scaled_eval
+
+
+def test_eval_cache_tells_lambdas_and_closures_apart():
+    df = generate_synthetic_data(freq='d')
+    cache = EvalCache()
+
+    # Same qualname, different code or closure values
+    for eval_func in [lambda df, feature_list: 1.0, lambda df, feature_list: 2.0, make_eval(3), make_eval(4)]:
+        cache.evaluate(eval_func, dict(df=df, feature_list=['a']))
+    assert cache.stats['misses'] == 4
+
+    # As model_ref in the eval kwargs, e.g. lambda **hypers: Ridge(alpha=1e6, **hypers)
+    assert cache.evaluate(model_eval, dict(df=df, feature_list=['a'], model_ref=lambda: 1e6)) == 1e6
+    assert cache.evaluate(model_eval, dict(df=df, feature_list=['a'], model_ref=lambda: 1e-3)) == 1e-3
+
+    assert cache.make_key(make_eval(3), dict(df=df, feature_list=['a'])) == \
+        cache.make_key(make_eval(3), dict(df=df, feature_list=['a']))
+
+
+def test_model_assumption_selector_cache_is_not_left_on_selectors():
+    from ml_tools.feature_selector import FeatureSelector
+    from ml_tools.model_assumption_selector import ModelAssumptionSelector
+
+    df = generate_synthetic_data(freq='d')
+    feature_selector = FeatureSelector(verbosity=0, remind_sorting=False)
+    for cache in [EvalCache(), EvalCache()]:
+        ModelAssumptionSelector(selectors=(feature_selector,), cache=cache, verbosity=0).run(
+            eval_func=count_eval, df=df, feature_list=['a', 'b'])
+        assert cache.stats['misses'] > 0
+        assert feature_selector.cache is None
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from lightgbm import LGBMRegressor
+
+from ml_tools.eval import get_mae_from_cv_time_series
+from ml_tools.feature_ranker import FeatureRanker
+from ml_tools.feature_selector import FeatureSelector
+
+
+@pytest.fixture
+def ranking_df(synthetic_df):
+    df = synthetic_df()
+    rng = np.random.default_rng(0)
+    df['signal'] = df.label + rng.normal(size=len(df), scale=1)
+    df['weak_signal'] = df.label + rng.normal(size=len(df), scale=20)
+    df['noise'] = rng.normal(size=len(df))
+    return df
+
+
+def test_permutation_ranking_puts_signal_first_and_noise_last(ranking_df, least_squares):
+    df = ranking_df
+    ranker = FeatureRanker(method='permutation', max_batch_values=1000)  # Small batches, to cover batching
+    ranked = ranker.run(get_mae_from_cv_time_series, df=df, model_ref=least_squares,
+                        feature_list=['noise', 'weak_signal', 'signal'])
+
+    assert ranked == ['signal', 'weak_signal', 'noise']
+    assert list(ranker.result_df.columns) == ['importance', 'importance_std']
+
+
+def test_feature_selector_with_ranker_uses_model_importances(ranking_df):
+    df = ranking_df
+    ranker = FeatureRanker(method='model')
+    fs = FeatureSelector(search_depth=1, ranker=ranker)
+    best_features = fs.run(eval_func=get_mae_from_cv_time_series, df=df, model_ref=LGBMRegressor,
+                           feature_list=['noise', 'weak_signal', 'signal'])
+
+    # Searches the ranked list, so the strong signal is tried first
+    assert list(ranker.result_df.index)[0] == 'signal'
+    assert best_features[0] == 'signal'
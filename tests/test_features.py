@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from ml_tools.datasets import generate_synthetic_data
+from ml_tools.features import FeatureBuilder
+
+SPEC = {
+    'calendar': ['dow', 'doy', 'week'],
+    'fourier': [{'period': 'year', 'order': 2}],
+    'lags': {'label': [1, 7]},
+    'rolling': {'label': {'windows': [7], 'stats': ['mean', 'std'], 'shift': 1}},
+}
+
+
+def test_features_match_pandas_reference():
+    df = generate_synthetic_data(freq='d', weekday_offset=True, yearly_offset=True)
+    features = FeatureBuilder(SPEC).build(df)
+
+    assert list(features.columns) == ['label'] + FeatureBuilder(SPEC).feature_names
+    np.testing.assert_array_equal(features['dow'], df.index.weekday)
+    np.testing.assert_array_equal(features['doy'], df.index.dayofyear)
+    np.testing.assert_array_equal(features['label_lag_7'], df['label'].shift(7))
+    np.testing.assert_allclose(features['label_rolling_std_7'], df['label'].shift(1).rolling(7).std())
+
+    # Seasonal terms depend on the timestamp only, not on where df starts
+    later = FeatureBuilder(SPEC).build(df.iloc[100:])
+    np.testing.assert_allclose(later['fourier_year_sin_2'], features['fourier_year_sin_2'].iloc[100:])
+
+
+def test_panel_lags_are_per_entity_and_features_are_cached():
+    df = generate_synthetic_data(freq='d', n_series=3, seed=0)
+    builder = FeatureBuilder({'lags': {'label': [1]}, 'rolling': {'label': {'windows': [3]}}}, entity_col='series_id')
+    features = builder.build(df)
+
+    for entity, entity_df in df.groupby('series_id'):
+        is_entity = (df['series_id'] == entity).to_numpy()
+        np.testing.assert_array_equal(features.loc[is_entity, 'label_lag_1'], entity_df['label'].shift(1))
+        np.testing.assert_allclose(features.loc[is_entity, 'label_rolling_mean_3'],
+                                   entity_df['label'].shift(1).rolling(3).mean())
+
+    assert builder.get_features(df) is builder.get_features(df)
+    assert builder.stats['misses'] == 1
+
+    # New label values are a new cache entry
+    changed = df.assign(label=df['label'] + 1)
+    assert not builder.get_features(changed).equals(builder.get_features(df))
+    assert builder.stats['misses'] == 2
+    assert isinstance(features.index, pd.DatetimeIndex)
@@ -0,0 +1,66 @@
+from ml_tools.eval import FoldPlan, get_mae_from_cv_time_series
+from ml_tools.fold_store import FoldStore
+
+
+def test_rerun_on_appended_data_only_fits_new_folds(tmp_path, least_squares, synthetic_df):
+    df = synthetic_df()
+    old_df = df.iloc[:-3]
+    n_old_folds = len(FoldPlan(old_df.index))
+    assert len(FoldPlan(df.index)) == n_old_folds + 1
+
+    fold_store = FoldStore(cache_dir=str(tmp_path))
+    assert (get_mae_from_cv_time_series(old_df, least_squares, ['dow', 'doy'], fold_store=fold_store) ==
+            get_mae_from_cv_time_series(old_df, least_squares, ['dow', 'doy']))
+    assert fold_store.stats == {'fitted': n_old_folds, 'predicted': 0, 'reused': 0}
+
+    # Next day: last fold's model predicts its new test rows, one new fold is fitted, the rest is reused
+    fold_store.clear()
+    assert (get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], fold_store=fold_store) ==
+            get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy']))
+    assert fold_store.stats == {'fitted': 1, 'predicted': 1, 'reused': n_old_folds - 1}
+
+    # Persisted, so a new process reuses everything, while other features or changed data are refitted
+    fold_store = FoldStore(cache_dir=str(tmp_path))
+    get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], fold_store=fold_store)
+    assert fold_store.stats['fitted'] == 0
+    get_mae_from_cv_time_series(df, least_squares, ['doy'], fold_store=fold_store)
+    assert fold_store.stats['fitted'] == n_old_folds + 1
+
+    changed_df = df.copy()
+    changed_df.iloc[-2, changed_df.columns.get_loc('label')] += 1
+    fold_store.clear()
+    get_mae_from_cv_time_series(changed_df, least_squares, ['dow', 'doy'], fold_store=fold_store)
+    assert fold_store.stats == {'fitted': 1, 'predicted': 1, 'reused': n_old_folds - 1}
+
+
+def test_predictions_are_bounded_and_files_pruned(tmp_path, least_squares, synthetic_df):
+    df = synthetic_df()
+    fold_store = FoldStore(cache_dir=str(tmp_path), max_models=2, max_predictions=3)
+    get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], fold_store=fold_store)
+
+    assert len(fold_store.predictions) == 3 and len(fold_store.models) == 2
+    assert fold_store.prune(keep_days=1) == 0
+    n_files = len(list(tmp_path.iterdir()))
+    assert fold_store.prune(keep_days=-1) == n_files
+
+
+def test_lambda_models_are_not_mixed_up(least_squares, synthetic_df):
+    df = synthetic_df()
+    fold_store = FoldStore()
+    for model_ref in [lambda: Scaled(least_squares(), 1), lambda: Scaled(least_squares(), 2)]:
+        get_mae_from_cv_time_series(df, model_ref, ['dow', 'doy'], fold_store=fold_store)
+    assert fold_store.stats['reused'] == 0
+
+
+class Scaled:
+    # Model whose predictions are scaled, to tell models apart
+    def __init__(self, model, scale):
+        self.model = model
+        self.scale = scale
+
+    def fit(self, X, y):
+        self.model.fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.scale * self.model.predict(X)
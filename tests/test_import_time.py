@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Optional dependencies that must not be imported with the selectors, only at first use
+HEAVY_MODULES = ['optuna', 'matplotlib', 'lightgbm', 'sqlalchemy', 'pyarrow']
+
+MEASURE_IMPORT = """
+import json, sys, time
+import numpy, pandas  # Core dependencies, not counted (pandas imports e.g. pyarrow itself when installed)
+core_modules = set(sys.modules)
+start = time.perf_counter()
+import ml_tools.feature_selector, ml_tools.train_start_selector, ml_tools.tuner, ml_tools.model_assumption_selector
+import ml_tools.eval, ml_tools.datasets, ml_tools.feature_ranker
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'modules': sorted(set(sys.modules) - core_modules)}))
+"""
+
+
+def test_cold_import_is_fast_and_skips_optional_dependencies():
+    # Fresh interpreter, so modules imported by other tests don't count
+    output = subprocess.run([sys.executable, '-c', MEASURE_IMPORT], cwd=REPO_DIR, capture_output=True, text=True,
+                            check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    # Only what ml_tools adds on top of numpy and pandas
+    imported = {module.split('.')[0] for module in result['modules']}
+    assert not imported.intersection(HEAVY_MODULES)
+    assert result['seconds'] < 0.5
@@ -0,0 +1,41 @@
+import json
+
+from ml_tools.eval import get_mae_from_cv_time_series
+from ml_tools.feature_selector import FeatureSelector
+from ml_tools.instrumentation import EventRecorder
+
+
+def test_recorder_collects_evaluations_and_folds(tmp_path, least_squares, synthetic_df):
+    df = synthetic_df()
+    recorder = EventRecorder()
+
+    FeatureSelector(verbosity=0, remind_sorting=False, callbacks=[recorder]).run(
+        eval_func=get_mae_from_cv_time_series,
+        df=df,
+        model_ref=least_squares,
+        feature_list=['dow', 'doy'],
+    )
+
+    evaluations = recorder.to_frame('candidate_evaluated')
+    folds = recorder.to_frame('fold')
+    assert len(evaluations) == 3  # Baseline and two single features
+    assert (evaluations['stage'] == 'FeatureSelector').all()
+    assert len(folds) > 0 and (folds['fit_time'] >= 0).all() and (folds['predict_time'] >= 0).all()
+    assert recorder.summary().loc['FeatureSelector', 'n_evals'] == 3
+
+    recorder.to_chrome_trace(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        assert len(json.load(f)['traceEvents']) == len(recorder.events)
+
+
+def test_model_assumption_selector_callbacks_are_not_left_on_selectors(least_squares, synthetic_df):
+    from ml_tools.model_assumption_selector import ModelAssumptionSelector
+
+    df = synthetic_df()
+    feature_selector = FeatureSelector(verbosity=0, remind_sorting=False)
+    recorder = EventRecorder()
+    ModelAssumptionSelector(selectors=(feature_selector,), callbacks=[recorder], verbosity=0).run(
+        eval_func=get_mae_from_cv_time_series, df=df, model_ref=least_squares, feature_list=['dow', 'doy'])
+
+    assert len(recorder.to_frame('candidate_evaluated')) == 3
+    assert feature_selector.callbacks is None
@@ -0,0 +1,34 @@
+import numpy as np
+from lightgbm import LGBMRegressor
+
+from ml_tools.eval import get_mae_from_cv_time_series
+from ml_tools.lgbm_backend import LGBMDatasetCache
+
+
+def test_dataset_cache_matches_generic_path_and_reuses_datasets(synthetic_df):
+    df = synthetic_df()
+    df['noise'] = np.random.default_rng(0).normal(size=len(df))
+    dataset_cache = LGBMDatasetCache(df, feature_list=['dow', 'doy', 'noise'])
+
+    for sliced_df in [df, df.iloc[100:]]:
+        for feature_list in [['dow', 'doy', 'noise'], ['dow', 'doy'], ['doy']]:
+            hypers = {'n_estimators': 20}
+            expected = get_mae_from_cv_time_series(sliced_df, LGBMRegressor, feature_list, hypers=hypers)
+            score = get_mae_from_cv_time_series(sliced_df, LGBMRegressor, feature_list, hypers=hypers,
+                                                dataset_cache=dataset_cache)
+            assert np.isclose(score, expected, rtol=1e-6)
+
+    # Fold datasets are constructed once per train start, and reused by the other feature subsets
+    assert dataset_cache.stats['reuses'] == 2 * dataset_cache.stats['datasets']
+    assert dataset_cache.stats['fallbacks'] == 0
+
+
+def test_dataset_cache_falls_back_for_other_estimators_and_binning_hypers(least_squares, synthetic_df):
+    df = synthetic_df()
+    dataset_cache = LGBMDatasetCache(df, feature_list=['dow', 'doy'])
+
+    assert (get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy'], dataset_cache=dataset_cache) ==
+            get_mae_from_cv_time_series(df, least_squares, ['dow', 'doy']))
+    get_mae_from_cv_time_series(df, LGBMRegressor, ['dow'], hypers={'max_bin': 15}, dataset_cache=dataset_cache)
+    assert dataset_cache.stats['fallbacks'] == 2
+    assert dataset_cache.stats['datasets'] == 0
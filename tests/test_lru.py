@@ -0,0 +1,12 @@
+from ml_tools.lru import LRUDict
+
+
+def test_lru_dict_evicts_least_recently_used():
+    lru = LRUDict(max_size=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1  # Now b is least recently used
+    lru.put('c', 3)
+
+    assert 'b' not in lru and len(lru) == 2
+    assert lru.get('b') is None and lru.get('a') == 1 and lru.get('c') == 3
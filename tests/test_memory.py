@@ -0,0 +1,65 @@
+import tracemalloc
+
+import numpy as np
+
+from ml_tools.datasets import generate_synthetic_data
+from ml_tools.eval import get_mae_from_cv_time_series
+from ml_tools.feature_selector import FeatureSelector
+from ml_tools.model_assumption_selector import ModelAssumptionSelector
+from ml_tools.selector_base_classes import TrainStartSelectorBase
+from ml_tools.train_start_selector import TrainStartSelector
+
+
+class MeanModel:
+    # Model without memory of its own, so traced memory is that of the pipeline
+    def fit(self, X, y):
+        self.mean = float(np.mean(y))
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.mean)
+
+
+def get_wide_df(n_features=8):
+    df = generate_synthetic_data(freq='h', start='2015-01-01 00:00', weekday_offset=True, yearly_offset=True)
+    rng = np.random.default_rng(0)
+    for i in range(n_features):
+        df[f'feature_{i}'] = rng.normal(size=len(df))
+    return df
+
+
+def test_train_start_update_is_a_view():
+    df = get_wide_df(n_features=2)
+    kwargs = {'df': df}
+    TrainStartSelectorBase.update_kwargs(kwargs, df.index[100], verbosity=0)
+
+    assert kwargs['df'].index[0] == df.index[100] and len(kwargs['df']) == len(df) - 100
+    assert np.shares_memory(kwargs['df']['feature_0'].to_numpy(), df['feature_0'].to_numpy())
+
+
+def test_pipeline_peak_memory_is_a_small_multiple_of_input():
+    df = get_wide_df()
+    input_bytes = df.memory_usage(index=True).sum()
+    mas = ModelAssumptionSelector(
+        selectors=(
+            TrainStartSelector(eval_window_rows=24 * 200, min_train_rows=24 * 30, search='grid', grid_size=4,
+                               refine_rounds=0),
+            FeatureSelector(search_depth=2, patience=0, verbosity=0, remind_sorting=False),
+        ),
+        verbosity=0,
+    )
+
+    tracemalloc.start()
+    try:
+        mas.run(
+            eval_func=get_mae_from_cv_time_series,
+            df=df,
+            model_ref=MeanModel,
+            feature_list=[c for c in df.columns if c != 'label'],
+        )
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # Feature array of one eval plus per row buffers, no copies of the frame along the pipeline
+    assert peak_bytes < 2.5 * input_bytes
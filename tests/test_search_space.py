@@ -0,0 +1,45 @@
+import optuna
+import pytest
+
+from ml_tools.search_space import CategoricalParam, FloatParam, IntParam, Param, SearchSpace
+
+
+def test_search_space_compiles_legacy_tuples_and_conditions():
+    space = SearchSpace([
+        ('learning_rate', 'trial.suggest_float', 0.03, 0.3),
+        ('n_estimators', 'trial.suggest_int', 10, 200),
+        CategoricalParam('boosting_type', ['gbdt', 'dart']),
+        FloatParam('drop_rate', 0.01, 0.5, log=True, condition={'boosting_type': 'dart'}),
+        IntParam('num_leaves', 8, 64, step=8),
+    ])
+
+    gbdt = space.suggest(optuna.trial.FixedTrial(
+        {'learning_rate': 0.1, 'n_estimators': 50, 'boosting_type': 'gbdt', 'num_leaves': 16}))
+    assert gbdt == {'learning_rate': 0.1, 'n_estimators': 50, 'boosting_type': 'gbdt', 'num_leaves': 16}
+
+    dart = space.suggest(optuna.trial.FixedTrial(
+        {'learning_rate': 0.1, 'n_estimators': 50, 'boosting_type': 'dart', 'drop_rate': 0.1, 'num_leaves': 16}))
+    assert dart['drop_rate'] == 0.1
+
+
+def test_search_space_validates_once():
+    with pytest.raises(AssertionError):
+        SearchSpace([('learning_rate', 'trial.suggest_flaot', 0.03, 0.3)])
+    with pytest.raises(AssertionError):
+        SearchSpace([FloatParam('learning_rate', 0, 0.3, log=True)])
+    with pytest.raises(AssertionError):
+        SearchSpace([FloatParam('drop_rate', 0.01, 0.5, condition={'boosting_type': 'dart'})])
+
+
+def test_search_space_maps_discrete_uniform_and_needs_suggest():
+    space = SearchSpace([('subsample', 'trial.suggest_discrete_uniform', 0.5, 1.0, 0.1)])
+    assert space.params[0].step == 0.1
+    assert space.suggest(optuna.trial.FixedTrial({'subsample': 0.7})) == {'subsample': 0.7}
+    with pytest.raises(AssertionError):
+        SearchSpace([('subsample', 'trial.suggest_discrete_uniform', 0.5, 1.0)])
+
+    class NoSuggestParam(Param):
+        pass
+
+    with pytest.raises(TypeError):
+        NoSuggestParam('x')
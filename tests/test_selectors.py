@@ -1,4 +1,5 @@
 import datetime
+import time
 import numpy as np
 from lightgbm import LGBMRegressor
 
@@ -96,3 +97,193 @@ def test_train_selector_drops_very_noisy_start():
 
     assert best_train_start >= df[chaos_slice].index.max()
     assert best_train_start < cv_start
+
+
+def test_feature_selector_parallel_matches_serial():
+
+    df = generate_synthetic_data(
+        freq='d',
+        weekday_offset=True,
+        yearly_offset=True,
+        start_value=100,
+        trend_stop_value=100
+    )
+    df['signal_with_noise'] = df.label + np.random.normal(size=len(df), scale=20)
+    df['dow'] = df.index.weekday
+    df['doy'] = df.index.dayofyear
+
+    kwargs = dict(
+        eval_func=get_mae_from_cv_time_series,
+        df=df,
+        model_ref=LGBMRegressor,
+        feature_list=[i for i in df.columns if i != 'label']
+    )
+    serial_fs = FeatureSelector()
+    serial_features = serial_fs.run(**kwargs)
+    parallel_fs = FeatureSelector(n_jobs=2)
+    parallel_features = parallel_fs.run(**kwargs)
+
+    assert parallel_features == serial_features
+    assert parallel_fs.result_df.equals(serial_fs.result_df)
+
+
+def test_train_selector_grid_search_drops_very_noisy_start():
+
+    df = generate_synthetic_data(
+        freq='d',
+        weekday_offset=True,
+        yearly_offset=True,
+        trend_stop_value=100
+    )
+
+    df['feature'] = df.label + np.random.normal(size=len(df), scale=5)
+    chaos_slice = df.index < '2020-01-01'
+    df.loc[chaos_slice, 'feature'] = (
+            df.loc[chaos_slice, 'label'] +
+            np.random.normal(size=sum(chaos_slice), scale=50)
+    )
+
+    cv_start = datetime.date(2021, 6, 10)
+
+    tss = TrainStartSelector(
+        eval_window_rows=len(df[cv_start:]),
+        min_train_rows=7 * 4,
+        search='grid',
+        granularity='W',
+    )
+
+    best_train_start = tss.run(
+        eval_func=get_mae_from_cv_time_series,
+        df=df,
+        model_ref=LGBMRegressor,
+        cv_start=cv_start
+    )
+
+    assert best_train_start >= df[chaos_slice].index.max()
+    assert best_train_start < cv_start
+    assert best_train_start.weekday() == 0  # Snapped to week start
+    assert len(tss.result_df) <= 3 * tss.grid_size
+
+
+def test_tuner_records_pruned_trials(synthetic_df):
+    import optuna
+    from ml_tools.tuner import Tuner
+
+    df = synthetic_df()
+
+    # Prunes every trial after its first fold, since any MAE is above zero
+    tuner = Tuner(
+        lazy_optuna_space=[('n_estimators', 'trial.suggest_int', 10, 50)],
+        n_trials=3,
+        pruner=optuna.pruners.ThresholdPruner(upper=0.0),
+    )
+    best_hypers = tuner.run(
+        eval_func=get_mae_from_cv_time_series,
+        df=df,
+        model_ref=LGBMRegressor,
+        feature_list=['dow', 'doy'],
+    )
+
+    assert best_hypers == {}
+    assert (tuner.result_df['state'] == 'PRUNED').all()
+
+
+def test_tuner_workers_share_resumable_study(tmp_path, synthetic_df):
+    from ml_tools.tuner import Tuner
+
+    df = synthetic_df()
+
+    def run_tuner():
+        tuner = Tuner(
+            lazy_optuna_space=[('n_estimators', 'trial.suggest_int', 10, 50)],
+            n_trials=4,
+            n_workers=2,
+            storage=str(tmp_path / 'study.db'),
+        )
+        tuner.run(
+            eval_func=get_mae_from_cv_time_series,
+            df=df,
+            model_ref=LGBMRegressor,
+            feature_list=['dow', 'doy'],
+        )
+        return tuner
+
+    first_tuner = run_tuner()
+    assert len(first_tuner.result_df) == 4
+
+    # Rerun resumes the finished study instead of starting over
+    tuner = run_tuner()
+    assert len(tuner.result_df) == 4 and tuner.inputs_fingerprint == first_tuner.inputs_fingerprint
+
+    # Same shape but other values, so a new study is run rather than reusing trials scored on the old data
+    df['label'] = df['label'] * 2
+    tuner = run_tuner()
+    assert tuner.inputs_fingerprint != first_tuner.inputs_fingerprint
+    assert (tuner.result_df['value'].to_numpy() != first_tuner.result_df['value'].to_numpy()).all()
+
+
+def test_model_assumption_selector_stops_at_time_budget(synthetic_df):
+    from ml_tools.model_assumption_selector import ModelAssumptionSelector
+
+    df = synthetic_df()
+
+    # Zero budget: each stage still returns a result from the first evaluation it makes
+    mas = ModelAssumptionSelector(
+        selectors=(TrainStartSelector(eval_window_rows=100, min_train_rows=100, search='grid'),
+                   FeatureSelector()),
+        time_budget=0,
+    )
+    best_assumptions = mas.run(
+        eval_func=get_mae_from_cv_time_series,
+        df=df,
+        model_ref=LGBMRegressor,
+        feature_list=['dow', 'doy'],
+    )
+
+    assert best_assumptions['TrainStartSelector'] == df.index[0]
+    assert set(best_assumptions['FeatureSelector']) == {'dow', 'doy'}
+    assert list(mas.budget_df.index) == ['TrainStartSelector', 'FeatureSelector']
+    assert (mas.budget_df['budget'] == 0).all()
+
+
+FEATURE_ERRORS = {'a': -3.0, 'b': -2.0, 'c': -1.0, 'd': 1.0, 'e': 2.0, 'f': 3.0}
+FULL_EVALUATIONS = []
+
+
+def get_feature_error(feature_list, fidelity=1.0):
+    # Proxy fidelity keeps the ranking of candidates, only full fidelity is counted
+    if fidelity == 1.0:
+        FULL_EVALUATIONS.append(feature_list)
+    return 10 + fidelity * sum(FEATURE_ERRORS[feature] for feature in feature_list)
+
+
+def test_feature_selector_successive_halving_promotes_best_candidates():
+    feature_list = list(FEATURE_ERRORS)
+
+    FULL_EVALUATIONS.clear()
+    best_features = FeatureSelector(search_depth=6, remind_sorting=False, verbosity=0).run(
+        eval_func=get_feature_error, feature_list=feature_list)
+    n_full_evaluations = len(FULL_EVALUATIONS)
+
+    FULL_EVALUATIONS.clear()
+    fs = FeatureSelector(search_depth=6, remind_sorting=False, verbosity=0,
+                         fidelities=[{'fidelity': 0.25}, {'fidelity': 0.5}], promote_fraction=0.5)
+    assert fs.run(eval_func=get_feature_error, feature_list=feature_list) == best_features
+    assert set(best_features) == {'a', 'b', 'c'}
+    assert len(FULL_EVALUATIONS) < n_full_evaluations
+
+
+def get_slow_feature_error(feature_list):
+    time.sleep(0.05)
+    return get_feature_error(feature_list, fidelity=0.5)
+
+
+def test_feature_selector_stops_between_candidates_at_deadline():
+    fs = FeatureSelector(search_depth=6, remind_sorting=False, verbosity=0)
+    fs.deadline = time.monotonic() + 0.12
+    start = time.monotonic()
+    best_features = fs.run(eval_func=get_slow_feature_error, feature_list=list(FEATURE_ERRORS))
+
+    # Baseline and a few candidates of the first iteration, instead of all six
+    assert time.monotonic() - start < 0.3
+    assert len(best_features) >= 1